@@ -1,8 +1,13 @@
-import json
 import os
+import asyncio
+import contextvars
+import httpx
+import prompts
+import chatmemory
 from dotenv import load_dotenv
-from groq import Groq
-from groq import Groq
+from groq import Groq, AsyncGroq
+from llmcache import cache_key, default_cache
+from llmjson import ObjectScanner
 from initstate import user_pfp
 from db import get_planning_context
 from datetime import datetime, timedelta
@@ -15,13 +20,35 @@ current_time_str = get_ist_time().strftime("%Y-%m-%d %H:%M")
 load_dotenv()
 API_KEY = os.getenv("API_KEY")
 
+# Tunables for the shared async client (one pool per process, shared by every Demon)
+LLM_BASE_URL = os.getenv("LLM_BASE_URL") or None
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "64"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+
+# Per-event LLM call count: ahandle_event sets a fresh [0] and every network call made
+# from that event's context (including tasks it spawns) adds to it. Demon.calls is the
+# process-wide total and can't be split between concurrent events.
+llm_calls = contextvars.ContextVar("llm_calls", default=None)
+
+_DEFAULT = object()
+
 class Demon:
-    def __init__(self):
-        self.client = Groq(api_key=os.getenv("API_KEY"))
+    _aclient = None
+    _aclient_loop = None
+    _limiter = None
+
+    def __init__(self, cache=_DEFAULT):
+        self.client = Groq(api_key=os.getenv("API_KEY"), base_url=LLM_BASE_URL,
+                           timeout=LLM_TIMEOUT, max_retries=LLM_MAX_RETRIES)
         self.model = "llama-3.1-8b-instant"
+        self.calls = 0
+        # leave out for the shared cache; cache=None always goes to the network
+        self.cache = default_cache() if cache is _DEFAULT else cache
 
-    def generate(self, system_prompt: str, user_prompt: str) -> str:
-        completion = self.client.chat.completions.create(
+    def _request(self, system_prompt, user_prompt):
+        return dict(
             model=self.model,
             messages=[
                 {"role": "system", "content": system_prompt},
@@ -31,180 +58,190 @@ class Demon:
             top_p=1,
             max_tokens=1024
         )
-        return completion.choices[0].message.content.strip()
-
-model  = Demon()
-model.generate("You are a helpful assistant.", "Hello, how are you?")
 
+    def _cached(self, system_prompt, user_prompt):
+        if self.cache is None:
+            return None, None
+        key = cache_key(self.model, system_prompt, user_prompt)
+        return key, self.cache.get(key)
 
-base_user_prompt = f"""
-You are the SOUL KING, an AI companion specifically designed for neurodivergent individuals (ADHD, Autism, etc.).
-Your tone is calm, supportive, and structured. 
-
-GUIDELINES:
-1. BRAIN DUMP TO PLAN: If the user is overwhelmed, help them brain dump.
-2. MICRO-STEPS: Never give a task longer than 5 minutes. Break them down.
-3. ENERGY AWARE: If energy is < 3, suggest rest.
-4. TIME BLINDNESS: Always include estimated durations for steps.
-
-Current User Profile:
-{user_pfp}
-"""
+    def _count_call(self):
+        self.calls += 1
+        counter = llm_calls.get()
+        if counter is not None:
+            counter[0] += 1
 
+    def _remember(self, key, response):
+        if key is not None:
+            self.cache.set(key, response)
 
+    def generate(self, system_prompt: str, user_prompt: str) -> str:
+        key, hit = self._cached(system_prompt, user_prompt)
+        if hit is not None:
+            return hit
+        self._count_call()
+        completion = self.client.chat.completions.create(**self._request(system_prompt, user_prompt))
+        response = completion.choices[0].message.content.strip()
+        self._remember(key, response)
+        return response
+
+    @classmethod
+    def _async_client(cls):
+        # httpx pools are bound to the loop that created them, so rebuild if the loop changed
+        loop = asyncio.get_running_loop()
+        if cls._aclient is None or cls._aclient_loop is not loop:
+            http_client = httpx.AsyncClient(
+                timeout=LLM_TIMEOUT,
+                limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS,
+                                    max_keepalive_connections=LLM_MAX_CONNECTIONS),
+            )
+            cls._aclient = AsyncGroq(api_key=os.getenv("API_KEY"), base_url=LLM_BASE_URL,
+                                     timeout=LLM_TIMEOUT, max_retries=LLM_MAX_RETRIES,
+                                     http_client=http_client)
+            cls._aclient_loop = loop
+            cls._limiter = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+        return cls._aclient
+
+    async def agenerate(self, system_prompt: str, user_prompt: str) -> str:
+        key, hit = self._cached(system_prompt, user_prompt)
+        if hit is not None:
+            return hit
+        self._count_call()
+        client = self._async_client()
+        async with Demon._limiter:
+            completion = await client.chat.completions.create(**self._request(system_prompt, user_prompt))
+        response = completion.choices[0].message.content.strip()
+        self._remember(key, response)
+        return response
+
+    async def astream(self, system_prompt: str, user_prompt: str):
+        """Yields the completion as text deltas; a cache hit arrives as one chunk."""
+        key, hit = self._cached(system_prompt, user_prompt)
+        if hit is not None:
+            yield hit
+            return
+        self._count_call()
+        client = self._async_client()
+        parts = []
+        async with Demon._limiter:
+            stream = await client.chat.completions.create(**self._request(system_prompt, user_prompt), stream=True)
+            async for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    parts.append(delta)
+                    yield delta
+        self._remember(key, "".join(parts).strip())
+
+    @classmethod
+    async def aclose(cls):
+        if cls._aclient is not None:
+            await cls._aclient.close()
+            cls._aclient = None
+            cls._aclient_loop = None
+
+_model = None
+
+def get_model():
+    """Process-wide Demon, built on first use instead of at import."""
+    global _model
+    if _model is None:
+        _model = Demon()
+    return _model
+
+async def awarm_up():
+    """Optional first round-trip (LLM_WARMUP=1) so the pool is hot before real traffic."""
+    try:
+        await get_model().agenerate("You are a helpful assistant.", "Hello, how are you?")
+    except Exception as e:
+        print(f"⚠️ LLM warm-up failed: {e}")
+
+
+base_user_prompt = prompts.base_prompt(user_pfp)
+
+
+# When a streaming /event request is in flight this holds an asyncio.Queue; convo and
+# decompose_tasks then stream through Demon.astream and push partial output into it.
+stream_sink = contextvars.ContextVar("stream_sink", default=None)
+
+
+def _decompose_prompts(user_task, base_user_prompt):
+    return prompts.decompose(base_user_prompt, user_task)
 
 def decompose_tasks(user_task,base_user_prompt,model):
-    user_task = user_task
-
-    task_decompo_prompt = """SYSTEM:
-    You break tasks into very small, gentle steps for neurodivergent users.
-    Each step must take less than 3 minutes.
-    Use simple language.
-    Return ONLY valid JSON.
-
-    Output schema:
-    {
-    "steps": [
-        { "text": string, "difficulty": number (0-9),"duration_minutes": number }
-    ],
-    "overall_difficulty": number (0-9)
-    
-    }
-    """
-
-    task_decompo_user = str(base_user_prompt) + f"""Task: {user_task}"""
-
-    r = model.generate(task_decompo_prompt, task_decompo_user)
-    return r
+    return model.generate(*_decompose_prompts(user_task, base_user_prompt))
+
+async def adecompose_tasks(user_task, base_user_prompt, model):
+    sink = stream_sink.get()
+    if sink is None:
+        return await model.agenerate(*_decompose_prompts(user_task, base_user_prompt))
+
+    # hand each step to the client as soon as its JSON object closes
+    scanner = ObjectScanner(depth=2)
+    parts = []
+    index = 0
+    async for delta in model.astream(*_decompose_prompts(user_task, base_user_prompt)):
+        parts.append(delta)
+        for step in scanner.feed(delta):
+            await sink.put({"type": "step_ready", "index": index, "step": step})
+            index += 1
+    return "".join(parts).strip()
+
+
+def _plan_prompts(user_text, base_user_prompt, el, user_id=None):
+    peak_hr, routines = get_planning_context(user_id)
+    now_ist = get_ist_time()
+    return prompts.plan(base_user_prompt, user_text, el,
+                        now_ist.strftime("%Y-%m-%d %H:%M"),
+                        (now_ist + timedelta(minutes=1)).strftime("%Y-%m-%d %H:%M"),
+                        peak_hr, routines)
 
+def plan_decompose(user_text, base_user_prompt, model, el, user_id=None):
+    return model.generate(*_plan_prompts(user_text, base_user_prompt, el, user_id))
 
-def plan_decompose(user_text, base_user_prompt, model, el):
-    peak_hr, routines = get_planning_context()
-    now_ist = get_ist_time()
-    now_str = now_ist.strftime("%Y-%m-%d %H:%M")
-    
-    day_planning_prompt = f"""SYSTEM:
-    You are a Bio-Rhythm Aware Planner. 
-    User's Peak Focus Hour: {peak_hr}
-    Existing Routines: {json.dumps(routines)}
-    ONLY GIVE VALID JSON.NO EXPLANATIONS.AGAIN ONLY VALID JSON.NO EXTRA TEXT.
-    
-    1. Integrate existing routines into the plan.
-    2. Match high-difficulty tasks to the Peak Focus Hour.
-    3. Ensure ALL 'start_time' values are in the FUTURE. If the current time is {now_str}, 
-    do not schedule anything before that.
-    4. Return ONLY valid JSON.
-    5. key should always be 'plan'.
-    6. "IMPORTANT: The current user time is {now_str}. Do NOT schedule any task start_time BEFORE this exact minute. If a task is meant to be 'immediate', schedule it for {get_ist_time() + timedelta(minutes=1)}."
-    Output schema: {{ "plan": [ {{ "activity": string, "difficulty": 0-9, "start_time": "YYYY-MM-DD HH:MM" }} ] }}
-    """
-    prompt = f"{base_user_prompt}Energy: {el}Request: {user_text}"
-    return model.generate(day_planning_prompt, prompt)
+async def aplan_decompose(user_text, base_user_prompt, model, el, user_id=None):
+    return await model.agenerate(*_plan_prompts(user_text, base_user_prompt, el, user_id))
 
-def convo(user_input,base_user_prompt,model,state):
+def _convo_prompts(user_input, base_user_prompt, state):
     if 'chat_history' not in state:
         state['chat_history'] = []
 
-    recent_history = state['chat_history'][-6:] 
+    summary, recent_history = chatmemory.context(state)
     last_ai_thought = state.get('last_ai_message', "No previous context.")
+    return prompts.convo(base_user_prompt, user_input, recent_history, last_ai_thought, summary)
 
-    convo_prompt = f"""SYSTEM:
-    You are a calm, supportive AI companion for neurodivergent users.
-    Your goal is to be a steady anchor. 
-    
-    RECENT CHAT HISTORY:
-    {recent_history}
-
-    LAST THING YOU SAID:
-    "{last_ai_thought}"
-    
-    GUIDELINES:
-    - Respond briefly (1–2 sentences).
-    - If the user says "Yes" or "Okay" to your last thought, confirm and pivot to task mode.
-    - If they seem overwhelmed, suggest a 2-minute breathing break.
-    """
-
-    convo_user = str(base_user_prompt) + f"\n\nUser: {user_input}"
-
-    response = model.generate(convo_prompt, convo_user)
-    
-    state['chat_history'].append(f"User: {user_input}")
-    state['chat_history'].append(f"AI: {response}")
+def _remember_exchange(state, user_input, response):
+    chatmemory.remember(state, f"User: {user_input}", f"AI: {response}")
     state['last_ai_message'] = response 
-    
+
+def convo(user_input,base_user_prompt,model,state):
+    response = model.generate(*_convo_prompts(user_input, base_user_prompt, state))
+    _remember_exchange(state, user_input, response)
     return response
 
+async def aconvo(user_input, base_user_prompt, model, state):
+    sink = stream_sink.get()
+    if sink is None:
+        response = await model.agenerate(*_convo_prompts(user_input, base_user_prompt, state))
+    else:
+        parts = []
+        async for delta in model.astream(*_convo_prompts(user_input, base_user_prompt, state)):
+            parts.append(delta)
+            await sink.put({"type": "token", "text": delta})
+        response = "".join(parts).strip()
+    _remember_exchange(state, user_input, response)
+    # the summary fold runs after the reply; don't bill it to this event
+    token = llm_calls.set(None)
+    try:
+        chatmemory.maybe_summarize(state, model)
+    finally:
+        llm_calls.reset(token)
+    return response
+
+def _intent_prompts(user_text):
+    return prompts.intent(user_text, get_ist_time().strftime("%Y-%m-%d %H:%M"))
+
 def extract_intent(user_text, model):
-    now_ist = get_ist_time()
-    now_str = now_ist.strftime("%Y-%m-%d %H:%M")
-
-    system_prompt = """
-    You extract structured meaning from user input.
-    You are high precision.
-    Return ONLY valid JSON. No explanations.
-
-    IMPORTANT:
-    Choose an execution intent ONLY if the user is clearly asking the assistant
-    to take responsibility for planning, breaking down, or remembering something.
-
-    Allowed intents (choose exactly ONE):
-
-    1. conversation
-    - LAST RESORT if nothing else fits
-    - Casual chat, emotions, complaints, questions, reflections
-    - Vague help requests without a concrete task
-    - Example: "I'm tired", "why is this so hard", "can you help me?"
-
-    2. task_decomposition
-    - ONE concrete task the user wants to do NOW
-    - Actionable immediately
-    - User Says to start or help with a specific task
-    - Not recurring, not about a whole day
-    - Example: "Help me study calculus", "Break down cleaning my room","Start now","lets go".
-
-    3. day_planning
-    - Organizing MULTIPLE tasks for today or a specific day
-    - Mentions "today", "my day", "schedule", or clearly implies multiple tasks
-    - Example: "Plan my day", "What should I do today?","I have this and that,plan it even if No time is given".
-
-    4. routine_management
-    - Recurring or habitual behavior
-    - NOT something to execute now
-    - Choose this ONLY if the user clearly implies repetition
-    - Example: "Every night I journal", "I usually study late"
-
-    5. profile_update
-    - User preferences, energy levels, focus patterns, support needs
-    - Changes how the assistant should behave in the future
-    - Trigger when the user shares personal traits, energy levels, or support needs (e.g., "I'm a morning person", "I have ADHD", "I prefer short steps").
-
-    STRICT RULES:
-    - If unsure, choose conversation.
-    - Do NOT infer habits unless repetition is explicit.
-    - Do NOT treat vague help requests as tasks.
-    -"SYSTEM: You are a cold, precise scheduler.
-    If 'Start' or 'Do' is in the input -> intent = 'task_decomposition'.
-    If multiple tasks or 'Plan' is in the input -> intent = 'day_planning'.
-    NEVER use 'conversation' if a task can be identified."""
-
-
-    user_prompt = f"""
-    Input: "{user_text}"
-    Today's Date/Time: {now_str}
-
-    Return JSON with:
-    - intent (one of the allowed intents)
-    - action (task that user want to do)
-    - temporal_reference (choose ONLY from: after_previous, none)
-    - time_of_the_task (normalized to HH:MM or YYYY-MM-DD HH:MM)
-    - is_routine (true if it's a recurring/habitual request, false if one-time)
-
-    Rules:
-    - If user says 'tomorrow', set time_explicit to the actual date of tomorrow.
-    - Be conservative with task_decomposition.
-    - ONLY REURN VALID JSON.JUST RETURN THE JSON.
-    """
-
-
-    result = model.generate(system_prompt, user_prompt)
-    return result
\ No newline at end of file
+    return model.generate(*_intent_prompts(user_text))
+
+async def aextract_intent(user_text, model):
+    return await model.agenerate(*_intent_prompts(user_text))
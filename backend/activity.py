@@ -0,0 +1,76 @@
+from datetime import datetime
+from db import get_conn
+from jobs import jobs
+
+# Append-only log of what users actually did, plus rollups kept in step with it so the
+# stats endpoints are primary-key reads instead of scans over the log.
+KINDS = ("step_completed", "task_completed", "task_skipped", "task_paused")
+
+
+def init_activity_db():
+    with get_conn() as conn:
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS activity_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT,
+            kind TEXT,
+            xp INTEGER DEFAULT 0,
+            timestamp DATETIME
+        )''')
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS activity_rollup (
+            user_id TEXT,
+            bucket TEXT,
+            kind TEXT,
+            count INTEGER DEFAULT 0,
+            xp INTEGER DEFAULT 0,
+            PRIMARY KEY (user_id, bucket, kind)
+        )''')
+        # top-N by XP or streak walks these instead of sorting user_stats
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_user_stats_xp ON user_stats (xp DESC)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_user_stats_streak ON user_stats (streak_count DESC)')
+
+
+def _buckets(when):
+    year, week, _ = when.isocalendar()
+    return (f"day:{when.strftime('%Y-%m-%d')}", f"week:{year}-W{week:02d}", "all")
+
+
+def log_activity(user_id, kind, xp=0, when=None):
+    """Stamped now, written by the background job queue when the app is serving."""
+    jobs.submit_after_commit(_append_activity, user_id, kind, xp, when or datetime.now())
+
+
+def _append_activity(user_id, kind, xp, when):
+    with get_conn() as conn:
+        conn.execute("INSERT INTO activity_log (user_id, kind, xp, timestamp) VALUES (?, ?, ?, ?)",
+                     (user_id, kind, xp, when.strftime("%Y-%m-%d %H:%M:%S")))
+        conn.executemany("""
+            INSERT INTO activity_rollup (user_id, bucket, kind, count, xp) VALUES (?, ?, ?, 1, ?)
+            ON CONFLICT(user_id, bucket, kind) DO UPDATE SET count = count + 1, xp = xp + excluded.xp
+        """, [(user_id, bucket, kind, xp) for bucket in _buckets(when)])
+
+
+def _rollup(user_id, bucket):
+    rows = get_conn().execute("SELECT kind, count, xp FROM activity_rollup WHERE user_id = ? AND bucket = ?",
+                              (user_id, bucket)).fetchall()
+    counts = {kind: 0 for kind in KINDS}
+    xp = 0
+    for kind, count, gained in rows:
+        counts[kind] = count
+        xp += gained
+    finished = counts["task_completed"] + counts["task_skipped"]
+    return dict(counts, xp=xp, completion_rate=round(counts["task_completed"] / finished, 3) if finished else None)
+
+
+def activity_stats(user_id, when=None):
+    today, week, everything = _buckets(when or datetime.now())
+    return {"today": _rollup(user_id, today), "week": _rollup(user_id, week), "all_time": _rollup(user_id, everything)}
+
+
+def leaderboard(by="xp", limit=10):
+    column = {"xp": "xp", "streak": "streak_count"}[by]
+    rows = get_conn().execute(f"SELECT user_id, xp, streak_count FROM user_stats ORDER BY {column} DESC LIMIT ?",
+                              (limit,)).fetchall()
+    return [{"user_id": user_id, "xp": xp, "streak": streak, "level": int(xp / 500) + 1}
+            for user_id, xp, streak in rows]
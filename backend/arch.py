@@ -1,18 +1,98 @@
-import re
 import json
+import time
+import os
+import asyncio
+import contextvars
 from cryptography.fernet import Fernet
 from datetime import datetime,timedelta
-from game import advance_step
-from LLMs import decompose_tasks, plan_decompose,convo,extract_intent,get_ist_time
+from game import advance_step, ledger
+from LLMs import adecompose_tasks, aplan_decompose, aconvo, aextract_intent, get_ist_time, stream_sink, llm_calls
 from render import render
-from db import check_for_scheduled_tasks, update_db_status, schedule_future_task,save_profile
+from db import check_for_scheduled_tasks, queue_status_update, schedule_future_task, schedule_tasks, save_profile
 from initstate import user_pfp
-
-
-def main_turn(user_text, state, user_pfp, el, model, base_user_prompt):
+from pii import surgical_pii_masker
+from llmjson import aparse_llm_json, IntentSlots, StepList, DayPlan, ObjectScanner
+from intentclf import get_classifier
+from activity import log_activity
+from jobs import jobs, after_commit
+
+
+# Opt-in: start decompose_tasks alongside the intent round-trip when the local classifier
+# leans towards task_decomposition, then keep or cancel it once the intent is known.
+SPECULATIVE_DECOMPOSE = os.getenv("SPECULATIVE_DECOMPOSE", "0").lower() in ("1", "true", "yes")
+SPECULATIVE_THRESHOLD = float(os.getenv("SPECULATIVE_THRESHOLD", "0.5"))
+
+speculation_stats = {"started": 0, "hits": 0, "wasted": 0, "cancelled": 0}
+_speculation = contextvars.ContextVar("speculation", default=None)
+
+
+async def _speculative_decompose(user_text, base_user_prompt, model):
+    # never stream a guess to the client; the real step_ready frames come from the kept result
+    stream_sink.set(None)
+    return await adecompose_tasks(user_text, base_user_prompt, model)
+
+
+def _maybe_speculate(event, base_user_prompt, model):
+    if not SPECULATIVE_DECOMPOSE or event["type"] != "USER_INPUT" or event["payload"] in ("HEARTBEAT", ""):
+        return None
+    user_text = surgical_pii_masker(event["payload"])
+    intent, confidence = get_classifier().classify(user_text)
+    if intent != "task_decomposition" or confidence < SPECULATIVE_THRESHOLD:
+        return None
+    speculation_stats["started"] += 1
+    return user_text, asyncio.ensure_future(_speculative_decompose(user_text, base_user_prompt, model))
+
+
+def _settle_speculation(spec):
+    if spec is None or spec[1] is None:
+        return
+    task = spec[1]
+    if task.done():
+        speculation_stats["wasted"] += 1
+        if not task.cancelled():
+            task.exception()  # consumed so asyncio doesn't warn about it
+    else:
+        speculation_stats["cancelled"] += 1
+        task.cancel()
+
+
+async def _take_speculation(user_text, base_user_prompt, model):
+    """The speculative decompose for this exact text if one is running, else a fresh call."""
+    spec = _speculation.get()
+    if spec is not None and spec[1] is not None and spec[0] == user_text:
+        task = spec[1]
+        _speculation.set((spec[0], None))
+        speculation_stats["hits"] += 1
+        res = await task
+        sink = stream_sink.get()
+        if sink is not None:
+            for index, step in enumerate(ObjectScanner(depth=2).feed(res)):
+                await sink.put({"type": "step_ready", "index": index, "step": step})
+        return res
+    return await adecompose_tasks(user_text, base_user_prompt, model)
+
+
+def speculation_rates():
+    started = speculation_stats["started"]
+    return dict(speculation_stats, enabled=SPECULATIVE_DECOMPOSE,
+                hit_rate=round(speculation_stats["hits"] / started, 3) if started else 0.0)
+
+
+async def aextract_slots(user_text, model):
+    # obvious inputs are classified locally; only the unsure ones cost a round-trip
+    classifier = get_classifier()
+    slots = classifier.fast_slots(user_text)
+    if slots is None:
+        slots = await aparse_llm_json(await aextract_intent(user_text, model), IntentSlots, model)
+        classifier.record(user_text, slots['intent'])
+    return slots
+
+
+async def amain_turn(user_text, state, user_pfp, el, model, base_user_prompt, slots=None):
     if user_text:
         user_text = surgical_pii_masker(user_text)
-        slots = json.loads(extract_intent(user_text, model))
+        if slots is None:
+            slots = await aextract_slots(user_text, model)
         context_state_update(state, slots)
 
     decision = scheduler(user_pfp, el, state)
@@ -24,7 +104,7 @@ def main_turn(user_text, state, user_pfp, el, model, base_user_prompt):
     if decision in ui_states:
         return render(decision, state)
 
-    executor(decision, user_text, state, base_user_prompt, model, el, user_pfp)
+    await aexecutor(decision, user_text, state, base_user_prompt, model, el, user_pfp, slots)
     
     
     state['current_intent'] = None
@@ -55,7 +135,7 @@ def scheduler(user_pfp, el, state):
         return "suggest_break"
     
 
-    db_result = check_for_scheduled_tasks()
+    db_result = check_for_scheduled_tasks(state.get('session_id'))
     if db_result is not None:  
         task_id, payload = db_result 
         task_data = json.loads(payload)
@@ -85,10 +165,27 @@ def scheduler(user_pfp, el, state):
 
 
 
-def handle_event(event, state, el, model,base_user_prompt):
+async def ahandle_event(event, state, el, model, base_user_prompt):
+    if event["payload"] not in ("HEARTBEAT", ""):
+        state['last_action_timestamp'] = time.time()
+    counter = [0]
+    calls_token = llm_calls.set(counter)
+    token = _speculation.set(_maybe_speculate(event, base_user_prompt, model))
+    try:
+        result = await _dispatch_event(event, state, el, model, base_user_prompt)
+    finally:
+        _settle_speculation(_speculation.get())
+        _speculation.reset(token)
+        llm_calls.reset(calls_token)
+    # LLM round-trips spent on this event (intent is extracted once per turn)
+    state['last_event_llm_calls'] = counter[0]
+    return result
+
+
+async def _dispatch_event(event, state, el, model, base_user_prompt):
 
     if event["type"] == "USER_INPUT" and (event["payload"] == "HEARTBEAT" or event["payload"] == ""):
-        return main_turn(
+        return await amain_turn(
             user_text=None, 
             state=state,
             user_pfp=user_pfp,
@@ -97,9 +194,9 @@ def handle_event(event, state, el, model,base_user_prompt):
             base_user_prompt=base_user_prompt
         )
     if event["type"] == "USER_INPUT":
-        # Extract intent first to see if we are switching gears
-        new_intent_data = extract_intent(event["payload"],model) 
-        new_intent_data = json.loads(new_intent_data)
+        # Extract intent once per turn; main_turn and executor reuse these slots
+        user_text = surgical_pii_masker(event["payload"])
+        new_intent_data = await aextract_slots(user_text, model)
         
         # If the user is starting a NEW task, we must kill the old 'active_steps'
         if (new_intent_data['intent'] in ["task_decomposition", "day_planning"]and not state.get('paused_task')):
@@ -111,40 +208,51 @@ def handle_event(event, state, el, model,base_user_prompt):
                 state['active_task_intent'] = None
         
         state['current_intent'] = new_intent_data['intent']
-        return main_turn(
-            user_text=event["payload"],
+        return await amain_turn(
+            user_text=user_text,
             state=state,
             user_pfp=user_pfp,
             el=el,
             model=model,
-            base_user_prompt=base_user_prompt
+            base_user_prompt=base_user_prompt,
+            slots=new_intent_data
         )
 
     if event["type"] == "USER_ACTION":
         payload = event["payload"]
         
         if payload == "DONE":
-            result = advance_step(state)
+            stats = None
+            steps = state.get("active_steps")
+            if steps and (state.get("current_step_index") or 0) + 1 >= len(steps):
+                # the celebration previews the reward: from the cache the task start warmed,
+                # else read off the loop
+                user_id = state.get("session_id") or "default_user"
+                stats = ledger.cached(user_id) or await ledger.astats(user_id)
+            result = advance_step(state, stats)
         
        
             if isinstance(result, dict) and result.get("type") == "celebration":
                 return result
         
-            return main_turn(None, state, None, el, model, base_user_prompt)
+            return await amain_turn(None, state, None, el, model, base_user_prompt)
         elif payload == "RESUME":
             resume_task(state)
         elif payload == "CANCEL_RESUME":
+            # one cancel is one skip, whether it drops a paused task, a pending one or both
+            if state.get('paused_task') or state.get('pending_task_from_db'):
+                log_activity(state.get('session_id') or "default_user", "task_skipped")
             state['paused_task'] = None  
             
             state['paused'] = False 
             state['current_intent'] = "conversation"
             
             if state.get('pending_task_from_db'):
-                update_db_status(state['pending_task_from_db'][0], "skipped")
+                queue_status_update(state['pending_task_from_db'][0], "skipped")
                 state['pending_task_from_db'] = None
                 
             state['convo'] = "Everything cleared. I'm standing by for a fresh start."
-            return main_turn(None, state, None, el, model, base_user_prompt)
+            return await amain_turn(None, state, None, el, model, base_user_prompt)
         
         elif payload == "CANCEL_RESUME":
             state['paused_task'] = None  
@@ -154,20 +262,22 @@ def handle_event(event, state, el, model,base_user_prompt):
             state['current_intent'] = "conversation"
             
             if state.get('pending_task_from_db'):
-                update_db_status(state['pending_task_from_db'][0], "skipped")
+                queue_status_update(state['pending_task_from_db'][0], "skipped")
+                log_activity(state.get('session_id') or "default_user", "task_skipped")
                 state['pending_task_from_db'] = None
                 
             state['convo'] = "Everything cleared. I'm standing by for a fresh start."
-            return main_turn(None, state, None, el, model, base_user_prompt)
+            return await amain_turn(None, state, None, el, model, base_user_prompt)
             
         elif payload == "COMMIT_TASK":
             state['user_confirmed_commitment'] = True
         elif payload == "SKIP_TASK":
             if state.get('pending_task_from_db'):
-                update_db_status(state['pending_task_from_db'][0], "skipped")
+                queue_status_update(state['pending_task_from_db'][0], "skipped")
+                log_activity(state.get('session_id') or "default_user", "task_skipped")
                 state['pending_task_from_db'] = None
         
-        return main_turn(None, state, None, el, model, base_user_prompt)
+        return await amain_turn(None, state, None, el, model, base_user_prompt)
     
     if event["type"] == "PROFILE_UPDATE":
         new_stats = event["payload"] 
@@ -184,12 +294,14 @@ def handle_event(event, state, el, model,base_user_prompt):
             "onboarding_complete": True 
         }
     
-def executor(decision, user_text, state, base_user_prompt, model, el, user_pfp):
+async def aexecutor(decision, user_text, state, base_user_prompt, model, el, user_pfp, slots=None):
     if decision == "decompose_task":
-        res = decompose_tasks(user_text, base_user_prompt, model)
-        state['active_steps'] = json.loads(res)["steps"]
+        res = await _take_speculation(user_text, base_user_prompt, model)
+        state['active_steps'] = (await aparse_llm_json(res, StepList, model))["steps"]
         state['current_step_index'] = 0
         state['active_task_intent'] = "task_decomposition"
+        state['active_task'] = (slots or {}).get('action') or user_text
+        jobs.submit(ledger.warm, state.get('session_id') or "default_user")
 
     elif decision == "trigger_deferred_task":
         task_id, payload = state['pending_task_from_db']
@@ -197,10 +309,12 @@ def executor(decision, user_text, state, base_user_prompt, model, el, user_pfp):
         
         task_info = json.loads(payload)
         
-        update_db_status(task_id, "active")
+        queue_status_update(task_id, "active")
         
-        res = decompose_tasks(task_info['activity'], base_user_prompt, model)
-        state['active_steps'] = json.loads(res)["steps"]
+        res = await adecompose_tasks(task_info['activity'], base_user_prompt, model)
+        state['active_steps'] = (await aparse_llm_json(res, StepList, model))["steps"]
+        state['active_task'] = task_info['activity']
+        jobs.submit(ledger.warm, state.get('session_id') or "default_user")
         state['current_step_index'] = 0
         
         
@@ -208,29 +322,29 @@ def executor(decision, user_text, state, base_user_prompt, model, el, user_pfp):
 
     elif decision == "interruption":
         pause_task(state)
-        state['convo'] = convo(user_text, base_user_prompt, model,state)
+        state['convo'] = await aconvo(user_text, base_user_prompt, model, state)
 
     elif decision == "CHAT":
-        state['convo'] = convo(user_text, base_user_prompt, model,state)
+        state['convo'] = await aconvo(user_text, base_user_prompt, model, state)
         
     if decision == "plan_decompose":
-        res = plan_decompose(user_text, base_user_prompt, model, el)
-        plan_data = json.loads(res)
+        res = await aplan_decompose(user_text, base_user_prompt, model, el, state.get('session_id'))
+        plan_data = await aparse_llm_json(res, DayPlan, model)
         
-        for item in plan_data['plan']:
-            print(f"task-->{item}")
-            schedule_future_task(item['start_time'], {
-                "activity": item['activity'], 
-                "difficulty": item.get('difficulty', 3),
-                "origin": "day_planning"
-            })
+        after_commit(schedule_tasks, [(item['start_time'], {
+            "activity": item['activity'], 
+            "difficulty": item.get('difficulty', 3),
+            "origin": "day_planning"
+        }) for item in plan_data['plan']], state.get('session_id'), "day_planning", True)
+        print(f"task--> {len(plan_data['plan'])} planned items scheduled")
             
         state['convo'] = "I've organized your day around your energy peaks. I'll nudge you when it's time for each task!"
         state['current_intent'] = "conversation"
         state['active_plan'] = None 
 
     elif decision == "routine_management":
-        slots = json.loads(extract_intent(user_text, model))
+        if slots is None:
+            slots = await aextract_slots(user_text, model)
         act = slots.get('action') or slots.get('activity') or "New Routine"
         now_ist = get_ist_time()
         
@@ -238,30 +352,37 @@ def executor(decision, user_text, state, base_user_prompt, model, el, user_pfp):
         if time_val and len(time_val) <= 5: 
             time_val = f"{now_ist.strftime('%Y-%m-%d')} {time_val}"
             
-        schedule_future_task(time_val, {
+        after_commit(schedule_future_task, time_val, {
             "activity": act, 
             "is_routine": True,
             "difficulty": 3
-        })
+        }, state.get('session_id'))
         
         state['convo'] = f"Locked in: {act} for {slots.get('time_of_the_task')}."
         state['current_intent'] = "conversation"
 
     
 
-def surgical_pii_masker(text):
-    if not isinstance(text, str):
-        return text
-    
-    text = re.sub(r'[\w\.-]+@[\w\.-]+\.\w+', '[EMAIL]', text)
-    
-    text = re.sub(r'\+?\d{1,4}?[-.\s]?\(?\d{1,3}?\)?[-.\s]?\d{1,4}[-.\s]?\d{1,4}[-.\s]?\d{1,9}', '[PHONE]', text)
-    
-    text = re.sub(r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}', '[IP_ADDR]', text)
-    
-    text = re.sub(r'\b\d{3}-\d{2}-\d{4}\b', '[ID_NUM]', text)
-    
-    return text
+class _BlockingModel:
+    """Lets the sync entry points drive the async pipeline with the blocking client."""
+    def __init__(self, model):
+        self.model = model
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    async def agenerate(self, system_prompt, user_prompt):
+        return self.model.generate(system_prompt, user_prompt)
+
+
+def handle_event(event, state, el, model, base_user_prompt):
+    return asyncio.run(ahandle_event(event, state, el, _BlockingModel(model), base_user_prompt))
+
+def main_turn(user_text, state, user_pfp, el, model, base_user_prompt, slots=None):
+    return asyncio.run(amain_turn(user_text, state, user_pfp, el, _BlockingModel(model), base_user_prompt, slots))
+
+def executor(decision, user_text, state, base_user_prompt, model, el, user_pfp, slots=None):
+    return asyncio.run(aexecutor(decision, user_text, state, base_user_prompt, _BlockingModel(model), el, user_pfp, slots))
 
 
 def context_state_update(state, slots):
@@ -278,11 +399,13 @@ def context_state_update(state, slots):
 
 def pause_task(state):
     if state.get("active_steps"):
+        log_activity(state.get("session_id") or "default_user", "task_paused")
         state["paused_task"] = {
             "steps": state["active_steps"],
             "step_index": state["current_step_index"], 
             "intent": state["active_task_intent"], 
-            "origin_text": state.get("last_user_text")
+            "origin_text": state.get("last_user_text"),
+            "activity": state.get("active_task")
         }
         state["active_steps"] = None
         state["current_step_index"] = 0 
@@ -292,7 +415,8 @@ def interruption_handler(state):
     state['paused_task'] = {
         'steps': state['active_steps'],
         'step_index': state['current_step_index'], 
-        'intent': state['active_task_intent']
+        'intent': state['active_task_intent'],
+        'activity': state.get('active_task')
     }
     state['active_steps'] = None 
     state['paused'] = True
@@ -304,6 +428,7 @@ def resume_task(state):
         state['active_steps'] = p['steps']
         state['current_step_index'] = p['step_index'] 
         state['active_task_intent'] = p['intent']
+        state['active_task'] = p.get('activity')
         
         state['paused_task'] = None
         state['paused'] = False
@@ -318,7 +443,59 @@ def clear_execution(state):
     state['pause_task'] = None
 
 
+def test_llm_calls_per_event():
+    """Turns against a stubbed Demon: one round-trip for chat, two for intent + decompose."""
+    from types import SimpleNamespace
+    from LLMs import Demon, LLM_MAX_CONCURRENCY
+    from initstate import init_state
 
+    replies = {
+        "Classify the user": json.dumps({"intent": "task_decomposition", "action": "sort the tax paperwork"}),
+        "Break the task": json.dumps({"steps": [{"text": "Find the folder", "difficulty": 2, "duration_minutes": 2}]}),
+    }
 
-
-
+    class StubDemon(Demon):
+        def __init__(self):
+            self.model = "stub"
+            self.calls = 0
+            self.cache = None
+
+        async def create(self, **request):
+            await asyncio.sleep(0.01)  # let concurrent events interleave
+            system = request["messages"][0]["content"]
+            text = next((r for k, r in replies.items() if k in system), "You've got this.")
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text))])
+
+        def _async_client(self):
+            if Demon._limiter is None:
+                Demon._limiter = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+            return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=self.create)))
+
+    async def turn(model, session_id, text):
+        state = init_state(session_id)
+        await ahandle_event({"type": "USER_INPUT", "payload": text}, state, 3, model, "")
+        return state['last_event_llm_calls']
+
+    async def run():
+        model = StubDemon()
+        chat = await turn(model, "llm_calls_chat", "hello")
+        task = await turn(model, "llm_calls_task", "sort out my tax paperwork")
+        both = await asyncio.gather(turn(model, "llm_calls_a", "sort out my tax paperwork"),
+                                    turn(model, "llm_calls_b", "sort out my tax paperwork"))
+        return chat, task, list(both), model.calls
+
+    print("🧮 COUNTING LLM ROUND-TRIPS PER EVENT 🧮")
+    classifier = get_classifier()
+    threshold, classifier.threshold = classifier.threshold, 1.0  # rules only, so the task turn asks the LLM
+    try:
+        chat, task, both, total = asyncio.run(run())
+    finally:
+        classifier.threshold = threshold
+        Demon._limiter = None
+
+    checks = [("conversation turn", chat, 1), ("intent + decompose", task, 2),
+              ("concurrent task turn A", both[0], 2), ("concurrent task turn B", both[1], 2)]
+    for label, got, expected in checks:
+        print(f"{'✅' if got == expected else '❌'} {label}: {got} call(s), expected {expected}")
+    print(f"   - Demon.calls total: {total}")
+    assert all(got == expected for _, got, expected in checks)
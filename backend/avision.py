@@ -1,13 +1,124 @@
-import google.generativeai as genai
-from PIL import Image
+from PIL import Image, ImageOps
 import os
 from dotenv import load_dotenv
 import io
+import json
 
 load_dotenv()
 KEY = os.getenv("GEMINI_API_KEY")
 
-genai.configure(api_key=KEY)
+# Ingestion limits: uploads past the cap are refused by UploadLimit from their Content-Length
+# or as soon as the body stream passes it, and what reaches Gemini is a re-encoded JPEG (no EXIF/GPS) with a bounded long side and size.
+VISION_MAX_UPLOAD_BYTES = int(os.getenv("VISION_MAX_UPLOAD_BYTES", str(15 * 1024 * 1024)))
+VISION_MAX_SIDE = int(os.getenv("VISION_MAX_SIDE", "1024"))
+VISION_MAX_ENCODED_BYTES = int(os.getenv("VISION_MAX_ENCODED_BYTES", str(300 * 1024)))
+UPLOAD_CHUNK = 64 * 1024
+
+
+class UploadTooLarge(ValueError):
+    """The upload went past VISION_MAX_UPLOAD_BYTES."""
+
+
+class UploadLimit:
+    """
+    ASGI middleware capping request bodies under `prefix`. Starlette parses (and spools) the
+    whole multipart body before the endpoint runs, so the cap has to be enforced here: a
+    Content-Length over it gets a 413 straight away, and a body that streams past it gets a
+    413 the moment it does, with the rest left unread.
+    """
+
+    def __init__(self, app, prefix="/vision", limit=VISION_MAX_UPLOAD_BYTES):
+        self.app = app
+        self.prefix = prefix
+        self.limit = limit
+        self.body_limit = limit + UPLOAD_CHUNK  # room for the multipart boundaries and headers
+
+    async def _reject(self, send):
+        body = json.dumps({"detail": f"upload is over {self.limit} bytes"}).encode()
+        await send({"type": "http.response.start", "status": 413,
+                    "headers": [(b"content-type", b"application/json"),
+                                (b"content-length", str(len(body)).encode()),
+                                (b"connection", b"close")]})
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.prefix):
+            return await self.app(scope, receive, send)
+        length = dict(scope["headers"]).get(b"content-length", b"")
+        if length.isdigit() and int(length) > self.body_limit:
+            return await self._reject(send)
+
+        received = 0
+        rejected = False
+
+        async def capped_receive():
+            nonlocal received, rejected
+            if rejected:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.body_limit:
+                    rejected = True
+                    await self._reject(send)
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def guarded_send(message):
+            if not rejected:
+                await send(message)
+
+        try:
+            await self.app(scope, capped_receive, guarded_send)
+        except Exception:
+            if not rejected:
+                raise  # otherwise it's the app noticing the body stopped; the 413 already went out
+
+
+async def read_upload(file, limit=VISION_MAX_UPLOAD_BYTES):
+    """
+    Reads an UploadFile chunk by chunk, giving up once it passes `limit`. The body has
+    already been received by then; UploadLimit is what keeps oversized uploads off the wire.
+    """
+    if getattr(file, "size", None) and file.size > limit:
+        raise UploadTooLarge(f"upload is over {limit} bytes")
+    chunks, size = [], 0
+    while True:
+        chunk = await file.read(UPLOAD_CHUNK)
+        if not chunk:
+            return b"".join(chunks)
+        size += len(chunk)
+        if size > limit:
+            raise UploadTooLarge(f"upload is over {limit} bytes")
+        chunks.append(chunk)
+
+
+def prepare_image(image_bytes, max_side=VISION_MAX_SIDE, max_bytes=VISION_MAX_ENCODED_BYTES):
+    """Downscaled, EXIF-free JPEG bytes for the model."""
+    img = Image.open(io.BytesIO(image_bytes))
+    # JPEG only: let the decoder skip straight to a 1/2, 1/4 or 1/8 scale before loading
+    img.draft("RGB", (max_side, max_side))
+    img = ImageOps.exif_transpose(img)  # keep the orientation the EXIF we are dropping asked for
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    img.thumbnail((max_side, max_side))
+    for quality in (85, 75, 65, 50, 35):
+        out = io.BytesIO()
+        img.save(out, format="JPEG", quality=quality)
+        if out.tell() <= max_bytes:
+            break
+    return out.getvalue()
+
+_vision_model = None
+
+def get_vision_model():
+    # the Gemini SDK is slow to import and configure, so pay for it on the first photo only
+    global _vision_model
+    if _vision_model is None:
+        import google.generativeai as genai
+        genai.configure(api_key=KEY)
+        _vision_model = genai.GenerativeModel('models/gemini-2.5-flash')
+    return _vision_model
 
 def photo_bytes_to_claim(image_bytes):
     """
@@ -15,9 +126,9 @@ def photo_bytes_to_claim(image_bytes):
     and returns a single, actionable CLAIM string.
     """
     
-    model = genai.GenerativeModel('models/gemini-2.5-flash')
+    model = get_vision_model()
     
-    img = Image.open(io.BytesIO(image_bytes))
+    img = {"mime_type": "image/jpeg", "data": prepare_image(image_bytes)}
 
     prompt = """
     You are an AI assistant for a user with ADHD/Executive Dysfunction.
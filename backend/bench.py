@@ -0,0 +1,855 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import threading
+
+# Local stand-in for the Groq API so benchmarks never touch the network.
+FAKE_LLM_DELAY = float(os.getenv("FAKE_LLM_DELAY", "0.05"))
+
+
+def _completion_body(content):
+    return json.dumps({
+        "id": "bench", "object": "chat.completion", "created": int(time.time()),
+        "model": "llama-3.1-8b-instant",
+        "choices": [{"index": 0, "finish_reason": "stop",
+                     "message": {"role": "assistant", "content": content}}],
+        "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+    }).encode()
+
+
+def _chunk_body(content):
+    return json.dumps({
+        "id": "bench", "object": "chat.completion.chunk", "created": int(time.time()),
+        "model": "llama-3.1-8b-instant",
+        "choices": [{"index": 0, "delta": {"content": content}, "finish_reason": None}],
+    })
+
+
+async def _stream_fake_reply(writer, reply, delay, pieces=20):
+    # same total latency as a blocking reply, but spread over SSE chunks
+    writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nTransfer-Encoding: chunked\r\n\r\n")
+    size = max(1, len(reply) // pieces)
+    for i in range(0, len(reply), size):
+        await asyncio.sleep(delay / pieces)
+        frame = f"data: {_chunk_body(reply[i:i + size])}\n\n".encode()
+        writer.write(f"{len(frame):x}\r\n".encode() + frame + b"\r\n")
+        await writer.drain()
+    frame = b"data: [DONE]\n\n"
+    writer.write(f"{len(frame):x}\r\n".encode() + frame + b"\r\n0\r\n\r\n")
+    await writer.drain()
+
+
+async def _serve_fake_llm(reader, writer, reply, delay):
+    try:
+        while True:
+            head = await reader.readuntil(b"\r\n\r\n")
+            length = 0
+            for line in head.decode().split("\r\n"):
+                if line.lower().startswith("content-length:"):
+                    length = int(line.split(":", 1)[1])
+            request = json.loads(await reader.readexactly(length) or b"{}")
+            content = reply(request) if callable(reply) else reply
+            if request.get("stream"):
+                await _stream_fake_reply(writer, content, delay)
+                continue
+            await asyncio.sleep(delay)
+            body = _completion_body(content)
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                         + f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionResetError):
+        pass
+    finally:
+        writer.close()
+
+
+def start_fake_llm_server(reply='{"intent": "conversation"}', delay=FAKE_LLM_DELAY):
+    """Runs the fake server on a background loop and returns its base URL.
+    `reply` is the completion text, or a callable that picks it from the request body."""
+    ready = threading.Event()
+    holder = {}
+
+    def run():
+        loop = asyncio.new_event_loop()
+        handler = lambda r, w: _serve_fake_llm(r, w, reply, delay)
+        server = loop.run_until_complete(asyncio.start_server(handler, "127.0.0.1", 0))
+        holder["port"] = server.sockets[0].getsockname()[1]
+        ready.set()
+        loop.run_forever()
+
+    threading.Thread(target=run, daemon=True).start()
+    ready.wait()
+    return f"http://127.0.0.1:{holder['port']}"
+
+
+def benchmark_llm_concurrency(total=64, levels=(1, 4, 16, 64)):
+    os.environ["LLM_BASE_URL"] = start_fake_llm_server()
+    os.environ.setdefault("API_KEY", "bench")
+    from LLMs import Demon
+
+    async def run(level):
+        model = Demon(cache=None)  # identical prompts would be cache hits after the first call
+        limiter = asyncio.Semaphore(level)
+
+        async def one():
+            async with limiter:
+                await model.agenerate("system", "user")
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(total)))
+        elapsed = time.perf_counter() - start
+        await Demon.aclose()
+        return elapsed
+
+    print(f"⚡ LLM throughput vs concurrency ({total} calls, {FAKE_LLM_DELAY * 1000:.0f} ms fake latency)")
+    for level in levels:
+        elapsed = asyncio.run(run(level))
+        print(f"   concurrency={level:<3} {total / elapsed:8.1f} req/s  ({elapsed:.2f}s)")
+
+
+def _per_call_get_profile(path, user_id):
+    # the pre-pool access pattern: connect, query, close on every call
+    import sqlite3
+    conn = sqlite3.connect(path)
+    row = conn.execute("SELECT data FROM profiles WHERE user_id = ?", (user_id,)).fetchone()
+    conn.close()
+    return row
+
+
+def benchmark_db_queries(n=5000):
+    import db
+    db.init_db()
+    db.save_profile("bench_user", {"prefers_short_steps": True})
+
+    start = time.perf_counter()
+    for _ in range(n):
+        _per_call_get_profile(db.DB_PATH, "bench_user")
+    before = n / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for _ in range(n):
+        db.get_conn().execute("SELECT data FROM profiles WHERE user_id = ?", ("bench_user",)).fetchone()
+    after = n / (time.perf_counter() - start)
+
+    print(f"🗄️  profile lookups ({n} queries, {db.DB_PATH})")
+    print(f"   connect-per-call: {before:10.0f} q/s")
+    print(f"   pooled:           {after:10.0f} q/s  ({after / before:.1f}x)")
+
+
+def benchmark_decryption(routines=10_000, tasks=100_000):
+    """Planner context and payload reads over encrypted rows: raw Fernet vs cache vs metadata columns."""
+    import tempfile
+    import db
+    with tempfile.TemporaryDirectory() as scratch:
+        db.DB_PATH = os.path.join(scratch, "bench.db")
+        db.close_conn()
+        db.DB_PLAINTEXT_METADATA = True
+        db.init_db()
+        cipher = db.get_cipher()
+        conn = db.get_conn()
+        with conn:
+            conn.executemany("INSERT INTO routines (name, difficulty, data) VALUES (?, ?, ?)",
+                             [(f"routine {i}", i % 10, cipher.encrypt(json.dumps(
+                                 {"activity": f"routine {i}", "difficulty": i % 10, "is_routine": True}).encode()))
+                              for i in range(routines)])
+            conn.executemany("INSERT INTO task_queue (scheduled_timestamp, status, encrypted_payload, session_id, "
+                             "activity, difficulty, is_routine) VALUES (?, 'pending', ?, ?, ?, ?, ?)",
+                             [(f"2099-01-01 {i % 24:02d}:{i % 60:02d}", cipher.encrypt(json.dumps(
+                                 {"activity": f"task {i % 500}", "difficulty": i % 10, "is_routine": i % 7 == 0}).encode()),
+                               f"s{i % 1000}", f"task {i % 500}", i % 10, i % 7 == 0) for i in range(tasks)])
+
+        start = time.perf_counter()
+        rows = conn.execute("SELECT data FROM routines").fetchall()
+        [json.loads(cipher.decrypt(r[0]).decode()) for r in rows]
+        raw_routines = time.perf_counter() - start
+
+        db.DB_PLAINTEXT_METADATA = False
+        start = time.perf_counter()
+        db.get_routines()
+        cold = time.perf_counter() - start
+        start = time.perf_counter()
+        db.get_routines()
+        warm = time.perf_counter() - start
+        db.DB_PLAINTEXT_METADATA = True
+        start = time.perf_counter()
+        db.get_routines()
+        metadata = time.perf_counter() - start
+
+        start = time.perf_counter()
+        payloads = conn.execute("SELECT id, encrypted_payload FROM task_queue").fetchall()
+        hits = [tid for tid, blob in payloads if json.loads(cipher.decrypt(blob).decode())["is_routine"]]
+        raw_filter = time.perf_counter() - start
+        start = time.perf_counter()
+        indexed = db.find_tasks(is_routine=True)
+        index_filter = time.perf_counter() - start
+        assert len(hits) == len(indexed)
+        db.close_conn()
+
+    print(f"🔐 encrypted reads ({routines} routines, {tasks} queued tasks)")
+    print(f"   routines, decrypt all:      {raw_routines * 1000:8.1f} ms")
+    print(f"   routines, cache cold/warm:  {cold * 1000:8.1f} / {warm * 1000:.1f} ms")
+    print(f"   routines, metadata columns: {metadata * 1000:8.1f} ms")
+    print(f"   routine tasks, decrypt+filter: {raw_filter * 1000:8.1f} ms")
+    print(f"   routine tasks, indexed column: {index_filter * 1000:8.1f} ms  ({len(indexed)} rows)")
+
+
+def benchmark_energy_histogram(rows=200_000, lookups=200):
+    """Peak focus hour: GROUP BY over `history` vs the maintained histogram."""
+    import random
+    import tempfile
+    import db
+    from datetime import datetime, timedelta
+    with tempfile.TemporaryDirectory() as scratch:
+        db.DB_PATH = os.path.join(scratch, "bench.db")
+        db.close_conn()
+        db.init_db()
+        conn = db.get_conn()
+        start_day = datetime.now() - timedelta(days=365)
+        samples = [(f"user{i % 50}", random.randint(1, 10),
+                    (start_day + timedelta(minutes=random.randint(0, 365 * 1440))).strftime("%Y-%m-%d %H:%M:%S"))
+                   for i in range(rows)]
+        with conn:
+            conn.executemany("INSERT INTO history (task_name, user_id, energy_level, timestamp) VALUES ('t', ?, ?, ?)", samples)
+        start = time.perf_counter()
+        db.rebuild_energy_histogram()
+        rebuild = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(lookups):
+            conn.execute("SELECT STRFTIME('%H', timestamp) as hr, AVG(energy_level) FROM history "
+                         "GROUP BY hr ORDER BY 2 DESC LIMIT 1").fetchone()
+        group_by = (time.perf_counter() - start) / lookups
+        start = time.perf_counter()
+        for i in range(lookups):
+            db.peak_focus_hour(f"user{i % 50}")
+        histogram = (time.perf_counter() - start) / lookups
+        start = time.perf_counter()
+        for i in range(lookups):
+            db.log_task_completion("t", 7, f"user{i % 50}")
+        insert = (time.perf_counter() - start) / lookups
+        db.close_conn()
+
+    print(f"📈 peak focus hour over {rows} history rows")
+    print(f"   GROUP BY history:   {group_by * 1e3:8.2f} ms/lookup")
+    print(f"   energy histogram:   {histogram * 1e3:8.2f} ms/lookup (per user)")
+    print(f"   log_task_completion {insert * 1e3:8.2f} ms/insert, one-off rebuild {rebuild:.2f} s")
+
+
+def benchmark_activity_stats(events=(1_000, 50_000), users=500, lookups=200):
+    """Weekly stats from rollups vs a scan of activity_log, as the log grows."""
+    import tempfile
+    import db
+    import activity
+    from game import init_gamification_db
+    from datetime import datetime
+    with tempfile.TemporaryDirectory() as scratch:
+        db.DB_PATH = os.path.join(scratch, "bench.db")
+        db.close_conn()
+        init_gamification_db()
+        conn = db.get_conn()
+        week_start = datetime.now().strftime("%Y-%m-%d")
+        print(f"📊 per-user weekly stats ({users} users)")
+        logged = 0
+        for target in events:
+            for i in range(logged, target):
+                activity.log_activity(f"user{i % users}", activity.KINDS[i % 4], 10 if i % 4 == 1 else 0)
+            logged = target
+            start = time.perf_counter()
+            for i in range(lookups):
+                conn.execute("SELECT kind, COUNT(*), SUM(xp) FROM activity_log WHERE user_id = ? AND timestamp >= ? "
+                             "GROUP BY kind", (f"user{i % users}", week_start)).fetchall()
+            scan = (time.perf_counter() - start) / lookups
+            start = time.perf_counter()
+            for i in range(lookups):
+                activity.activity_stats(f"user{i % users}")
+            rollup = (time.perf_counter() - start) / lookups
+            print(f"   {target:>7} events: scan {scan * 1e3:7.3f} ms, rollups {rollup * 1e3:7.3f} ms")
+        db.close_conn()
+
+
+def _phone_photo(width, height):
+    """A noisy JPEG with EXIF, sized like a real camera capture."""
+    from PIL import Image
+    import io
+    img = Image.effect_noise((width // 4, height // 4), 60).convert("RGB").resize((width, height))
+    exif = Image.Exif()
+    exif[0x0112] = 6  # rotated 90°, as phones usually write it
+    out = io.BytesIO()
+    img.save(out, format="JPEG", quality=92, exif=exif)
+    return out.getvalue()
+
+
+def benchmark_vision_ingest(runs=3):
+    """Bytes sent to the vision model and preprocessing time, per source resolution."""
+    from PIL import Image
+    import io
+    from avision import prepare_image
+    print(f"🖼️  vision ingestion (p50 of {runs})")
+    for label, size in (("1 MP", (1280, 800)), ("4 MP", (2304, 1728)), ("12 MP", (4032, 3024))):
+        photo = _phone_photo(*size)
+        before, after = [], []
+        for _ in range(runs):
+            # before: the SDK turned the full-resolution PIL image into a lossless WebP
+            start = time.perf_counter()
+            webp = io.BytesIO()
+            Image.open(io.BytesIO(photo)).save(webp, format="webp", lossless=True)
+            before.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            out = prepare_image(photo)
+            after.append(time.perf_counter() - start)
+        p50 = lambda xs: sorted(xs)[runs // 2] * 1000
+        print(f"   {label:>5}: before {webp.tell() / 1024:6.0f} KB in {p50(before):7.1f} ms | "
+              f"after {len(out) / 1024:4.0f} KB in {p50(after):6.1f} ms")
+
+
+def _scene(seed, size=(1600, 1200)):
+    import random
+    from PIL import Image, ImageDraw
+    rng = random.Random(seed)
+    img = Image.new("RGB", size, tuple(rng.randrange(256) for _ in range(3)))
+    draw = ImageDraw.Draw(img)
+    for _ in range(25):
+        x, y = rng.randrange(size[0]), rng.randrange(size[1])
+        box = [x, y, x + rng.randrange(80, 600), y + rng.randrange(80, 500)]
+        fill = tuple(rng.randrange(256) for _ in range(3))
+        (draw.ellipse if rng.random() < 0.5 else draw.rectangle)(box, fill=fill)
+    return img
+
+
+def _jpeg(img, quality=90):
+    import io
+    out = io.BytesIO()
+    img.save(out, format="JPEG", quality=quality)
+    return out.getvalue()
+
+
+def benchmark_vision_cache(scenes=20, model_delay=0.5):
+    """Near-duplicate uploads against the dHash claim cache, with a stubbed vision model."""
+    from PIL import ImageEnhance
+    from visioncache import ClaimCache, dhash
+
+    class StubVision:
+        calls = 0
+
+        def claim(self, image_bytes):
+            self.calls += 1
+            time.sleep(model_delay)
+            return f"The user needs to deal with scene {self.calls}."
+
+    model, cache = StubVision(), ClaimCache()
+    uploads = []
+    for seed in range(scenes):
+        img = _scene(seed)
+        w, h = img.size
+        uploads.append((seed, "original", _jpeg(img)))
+        uploads.append((seed, "recompressed", _jpeg(img.resize((w * 3 // 4, h * 3 // 4)), quality=60)))
+        uploads.append((seed, "brighter", _jpeg(ImageEnhance.Brightness(img).enhance(1.15))))
+        uploads.append((seed, "cropped", _jpeg(img.crop((w // 50, h // 50, w - w // 50, h - h // 50)))))
+
+    seen, wrong, hash_time, start = {}, 0, 0.0, time.perf_counter()
+    for seed, variant, data in uploads:
+        t0 = time.perf_counter()
+        image_hash = dhash(data)
+        hash_time += time.perf_counter() - t0
+        claim = cache.lookup("bench", image_hash)
+        if claim is None:
+            claim = model.claim(data)
+            cache.store("bench", image_hash, claim)
+        wrong += seen.setdefault(seed, claim) != claim
+    elapsed = time.perf_counter() - start
+
+    print(f"🔁 vision claim cache ({len(uploads)} uploads of {scenes} scenes, {model_delay * 1000:.0f} ms stub model)")
+    print(f"   model calls {model.calls} (was {len(uploads)}), claims from another scene {wrong}")
+    print(f"   dhash {hash_time / len(uploads) * 1000:.2f} ms/upload, total {elapsed:.1f}s "
+          f"(was ~{len(uploads) * model_delay:.1f}s)  {cache.stats()}")
+
+
+def benchmark_done_latency(sessions=400, concurrency=32):
+    """/event DONE latency under concurrent load, disk writes inline vs on the background queue."""
+    import io
+    import contextlib
+    import tempfile
+    import httpx
+    import db
+    from jobs import jobs
+    os.environ["LLM_BASE_URL"] = start_fake_llm_server()
+    os.environ.setdefault("API_KEY", "bench")
+
+    async def run(workers):
+        import main
+        jobs.worker_count = workers
+        limiter = asyncio.Semaphore(concurrency)
+        latencies = []
+
+        async def done(client, sid):
+            main.sessions[sid] = main.init_state(sid)
+            main.sessions[sid]["active_steps"] = [{"text": "Wipe the counter", "difficulty": 4, "duration_minutes": 2}]
+            main.ledger.warm(sid)  # what starting the task through decompose does in the background
+            async with limiter:
+                start = time.perf_counter()
+                r = await client.post("/event", json={"session_id": sid, "event_type": "USER_ACTION", "payload": "DONE"})
+                latencies.append(time.perf_counter() - start)
+                assert r.json()["data"]["type"] == "celebration"
+
+        async with main.app.router.lifespan_context(main.app):
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                start = time.perf_counter()
+                await asyncio.gather(*(done(client, f"{workers}-{i}") for i in range(sessions)))
+                elapsed = time.perf_counter() - start
+        stats = jobs.stats()
+        latencies.sort()
+        return latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)], elapsed, stats
+
+    print(f"🏁 /event DONE latency ({sessions} task completions, {concurrency} in flight)")
+    with tempfile.TemporaryDirectory() as scratch:
+        db.DB_PATH = os.path.join(scratch, "bench.db")
+        db.close_conn()
+        for label, workers in (("inline", 0), ("queued", 1)):
+            with contextlib.redirect_stdout(io.StringIO()):
+                p50, p99, elapsed, stats = asyncio.run(run(workers))
+            print(f"   {label}: p50 {p50 * 1000:6.1f} ms  p99 {p99 * 1000:6.1f} ms  ({sessions / elapsed:.0f} req/s)  "
+                  f"jobs done {stats['done']}, max depth {stats['max_depth']}, ran by caller {stats['backpressure']}")
+        db.close_conn()
+
+
+def _schedule_one_by_one(conn, cipher, items, session_id):
+    # the old executor loop: encrypt, insert and commit once per plan item
+    for start_time, task_data in items:
+        with conn:
+            conn.execute("INSERT INTO task_queue (scheduled_timestamp, status, encrypted_payload, session_id, "
+                         "activity, difficulty, is_routine) VALUES (?, 'pending', ?, ?, NULL, NULL, 0)",
+                         (start_time, cipher.encrypt(json.dumps(task_data).encode()), session_id))
+
+
+def benchmark_bulk_schedule(sessions=1000, items=50):
+    """Planning 50-item days for 1k sessions: per-item commits vs one bulk transaction, then a re-plan."""
+    import io
+    import contextlib
+    import tempfile
+    import db
+
+    def day(session, replanned=False):
+        # a re-plan keeps most items and moves every fifth one to a later slot
+        slots = [i + 3 if replanned and i % 5 == 0 else i for i in range(items)]
+        return [(f"2099-01-01 {9 + slot // 6:02d}:{slot % 6 * 10:02d}",
+                 {"activity": f"task {i} of {session}", "difficulty": i % 10, "origin": "day_planning"})
+                for i, slot in enumerate(slots)]
+
+    with tempfile.TemporaryDirectory() as scratch:
+        db.DB_PATH = os.path.join(scratch, "bench.db")
+        db.close_conn()
+        db.init_db()
+        conn, cipher = db.get_conn(), db.get_cipher()
+
+        start = time.perf_counter()
+        for s in range(sessions):
+            _schedule_one_by_one(conn, cipher, day(f"old{s}"), f"old{s}")
+            _schedule_one_by_one(conn, cipher, day(f"old{s}"), f"old{s}")
+        before = time.perf_counter() - start
+        old_rows = conn.execute("SELECT COUNT(*) FROM task_queue WHERE session_id LIKE 'old%'").fetchone()[0]
+
+        start = time.perf_counter()
+        for s in range(sessions):
+            db.schedule_tasks(day(f"new{s}"), f"new{s}", "day_planning", replace=True)
+        first = time.perf_counter() - start
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            for s in range(sessions):
+                db.schedule_tasks(day(f"new{s}", replanned=True), f"new{s}", "day_planning", replace=True)
+        replan = time.perf_counter() - start
+        pending, superseded = conn.execute("""SELECT SUM(status = 'pending'), SUM(status = 'superseded')
+            FROM task_queue WHERE session_id LIKE 'new%'""").fetchone()
+        db.close_conn()
+
+    print(f"📅 bulk scheduling ({sessions} sessions x {items}-item day, planned twice)")
+    print(f"   per-item commits: {before:6.2f}s  {old_rows} rows (duplicates stacked)")
+    print(f"   bulk:             {first + replan:6.2f}s  ({before / (first + replan):.1f}x; plan {first:.2f}s, "
+          f"re-plan {replan:.2f}s)  {pending} pending, {superseded} superseded")
+
+
+def _legacy_pii_masker(text):
+    import re
+    text = re.sub(r'[\w\.-]+@[\w\.-]+\.\w+', '[EMAIL]', text)
+    text = re.sub(r'\+?\d{1,4}?[-.\s]?\(?\d{1,3}?\)?[-.\s]?\d{1,4}[-.\s]?\d{1,4}[-.\s]?\d{1,9}', '[PHONE]', text)
+    text = re.sub(r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}', '[IP_ADDR]', text)
+    text = re.sub(r'\b\d{3}-\d{2}-\d{4}\b', '[ID_NUM]', text)
+    return text
+
+
+PII_SAMPLES = [
+    ("call me at +1 (555) 123-4567 tomorrow", "[PHONE]"),
+    ("the router is 192.168.1.10, can't reach it", "[IP_ADDR]"),
+    ("ssn 123-45-6789 for the form", "[ID_NUM]"),
+    ("send it to jane.doe+work@mail.example.com please", "[EMAIL]"),
+    ("dentist number 07911 123456 ugh", "[PHONE]"),
+    ("card 4111 1111 1111 1111 for the deposit", "[CARD]"),
+    ("order #12345678 should arrive friday", "#12345678"),
+]
+
+# whole-output regressions: nothing of a card left behind, references left alone
+PII_EXACT = [
+    ("4111 1111 1111 1111", "[CARD]"),
+    ("pay with 4111-1111-1111-1111 today", "pay with [CARD] today"),
+    ("order #12345678", "order #12345678"),
+    ("order #12345678, call +1 (555) 123-4567", "order #12345678, call [PHONE]"),
+]
+
+
+def _pii_corpus(seed=7):
+    """Realistic brain-dumps plus the shapes that make backtracking regexes blow up."""
+    import random
+    rng = random.Random(seed)
+    words = "ok so I need to clean the kitchen then email the landlord about rent and maybe call mom".split()
+    realistic = []
+    for _ in range(2000):
+        parts = [rng.choice(words) for _ in range(rng.randint(5, 40))]
+        if rng.random() < 0.4:
+            parts.insert(rng.randrange(len(parts)), rng.choice(PII_SAMPLES)[0])
+        if rng.random() < 0.2:
+            parts.append(f"at {rng.randint(1, 12)}:{rng.randint(10, 59)} on 2026-{rng.randint(1, 12):02d}-{rng.randint(10, 28)}")
+        realistic.append(" ".join(parts))
+    adversarial = {
+        "digits": "1" * 20_000,
+        "digit-blanks": "1 " * 10_000,
+        "separators": "1-." * 7_000,
+        "open-parens": "+(1" * 7_000,
+        "long-word": "a" * 20_000,
+        "dotted-word": "a." * 10_000 + "@",
+        "at-signs": "a@" * 10_000,
+        "ip-like": "1.2.3." * 4_000,
+        "hash-refs": "#1" * 10_000,
+    }
+    return realistic, adversarial
+
+
+def benchmark_pii(chunkings=200):
+    """MB/s and worst-case latency of the PII masker vs the old four-pass version, plus fuzzing."""
+    import random
+    from pii import surgical_pii_masker, mask_stream
+
+    realistic, adversarial = _pii_corpus()
+    size_mb = sum(len(t) for t in realistic) / 1e6
+    print(f"🛡️ PII masker ({len(realistic)} messages, {size_mb:.2f} MB realistic; {len(adversarial)} adversarial inputs)")
+    for label, masker in (("old", _legacy_pii_masker), ("new", surgical_pii_masker)):
+        start = time.perf_counter()
+        for text in realistic:
+            masker(text)
+        throughput = size_mb / (time.perf_counter() - start)
+        worst = (0.0, None)
+        for name, text in adversarial.items():
+            t0 = time.perf_counter()
+            masker(text)
+            worst = max(worst, ((time.perf_counter() - t0) * 1000, name))
+        print(f"   {label}: {throughput:6.2f} MB/s realistic, worst case {worst[0]:8.1f} ms ({worst[1]}, 20 KB)")
+
+    rng = random.Random(11)
+    failures = []
+    for text, label in PII_SAMPLES:
+        if label not in surgical_pii_masker(text):
+            failures.append(f"{label} not masked in {text!r}")
+        if label not in _legacy_pii_masker(text):
+            print(f"   old masker misses {label} in {text!r}: {_legacy_pii_masker(text)!r}")
+    for text, expected in PII_EXACT:
+        if surgical_pii_masker(text) != expected:
+            failures.append(f"{text!r} masked as {surgical_pii_masker(text)!r}, expected {expected!r}")
+    inputs = realistic[:500] + list(adversarial.values()) + [text for text, _ in PII_EXACT]
+    for text in inputs:
+        once = surgical_pii_masker(text)
+        if surgical_pii_masker(once) != once:
+            failures.append(f"not idempotent on {text[:40]!r}")
+    for _ in range(chunkings):
+        text = rng.choice(inputs)
+        cuts = sorted(rng.sample(range(1, len(text)), min(rng.randint(1, 20), len(text) - 1)))
+        chunks = [text[a:b] for a, b in zip([0] + cuts, cuts + [len(text)])]
+        if "".join(mask_stream(chunks)) != surgical_pii_masker(text):
+            failures.append(f"streamed output differs on {text[:40]!r}")
+    print(f"   fuzz: {len(PII_SAMPLES)} labelled samples, {len(PII_EXACT)} exact cases, {len(inputs)} idempotence inputs, "
+          f"{chunkings} random chunkings -> {len(failures)} failures")
+    for failure in failures[:10]:
+        print(f"   ❌ {failure}")
+
+
+def _legacy_session(session_id, steps=8, turns=60):
+    """A session as the old plain dict held it after a few turns."""
+    active = [{"text": f"Step {i}: put one thing back where it lives ({session_id})", "difficulty": 3,
+               "duration_minutes": 2} for i in range(steps)]
+    history = []
+    for turn in range(turns):
+        history += [f"User: message {turn} from {session_id} about the kitchen", f"AI: reply {turn}, one small step"]
+    return {
+        "session_id": session_id, "current_intent": "task_decomposition", "active_task_intent": "task_decomposition",
+        "active_plan": None, "plan_index": None, "active_steps": active, "current_step_index": 1,
+        "paused_task": {"steps": [dict(s) for s in active], "step_index": 2, "intent": None},
+        "paused": False, "onboarding_complete": True, "onboarding_step": 0, "chat_history": history,
+        "user_pfp": {"prefers_short_steps": True, "time_blindness": True, "easily_overwhelmed": True, "prefers_voice": True},
+        "total_xp": 120, "level": 1, "streak": 3, "focus_shields": 3, "convo": None,
+        "last_energy_level": 6, "last_action_timestamp": time.time(), "last_event_llm_calls": 1,
+    }
+
+
+def benchmark_session_memory(sessions=10_000, steps=8, turns=60):
+    """Bytes per live session and snapshot cost: plain dicts vs SessionState."""
+    import tracemalloc
+    from initstate import SessionState, dump_state, load_state
+
+    def measure(build):
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        live = [build(f"s{i}") for i in range(sessions)]
+        used = sum(stat.size_diff for stat in tracemalloc.take_snapshot().compare_to(before, "filename"))
+        tracemalloc.stop()
+        return used / sessions, live
+
+    old_bytes, old_live = measure(lambda sid: _legacy_session(sid, steps, turns))
+    new_bytes, new_live = measure(lambda sid: SessionState.from_dict(_legacy_session(sid, steps, turns)))
+
+    def snapshot_cost(states, dump, load):
+        start = time.perf_counter()
+        blobs = [dump(st) for st in states]
+        dumped = time.perf_counter() - start
+        start = time.perf_counter()
+        for blob in blobs:
+            load(blob)
+        return sum(map(len, blobs)) / len(blobs), dumped / len(blobs) * 1e6, (time.perf_counter() - start) / len(blobs) * 1e6
+
+    sample = 2000
+    json_cost = snapshot_cost(old_live[:sample], lambda st: json.dumps(st, default=str), json.loads)
+    compact_cost = snapshot_cost(new_live[:sample], dump_state, load_state)
+    print(f"🧠 session memory ({sessions} sessions, {steps} steps, {turns} chat turns each)")
+    print(f"   dict:         {old_bytes:8.0f} B/session")
+    print(f"   SessionState: {new_bytes:8.0f} B/session  ({old_bytes / new_bytes:.1f}x smaller)")
+    for label, (size, dump_us, load_us) in (("json", json_cost), ("compact", compact_cost)):
+        print(f"   {label:<7} snapshot {size:7.0f} B, dump {dump_us:6.1f} us, load {load_us:6.1f} us")
+
+
+def benchmark_stream_ttfb(runs=5):
+    steps = {"steps": [{"text": f"Step {i}: pick up one thing", "difficulty": 2, "duration_minutes": 2}
+                       for i in range(8)], "overall_difficulty": 3}
+    os.environ["LLM_BASE_URL"] = start_fake_llm_server(json.dumps(steps), delay=0.5)
+    os.environ.setdefault("API_KEY", "bench")
+    from LLMs import Demon, adecompose_tasks, stream_sink
+
+    async def run():
+        model = Demon(cache=None)
+        blocking, first = [], []
+        for _ in range(runs):
+            start = time.perf_counter()
+            await adecompose_tasks("clean my room", "", model)
+            blocking.append(time.perf_counter() - start)
+
+            sink = asyncio.Queue()
+            token = stream_sink.set(sink)
+            start = time.perf_counter()
+            task = asyncio.create_task(adecompose_tasks("clean my room", "", model))
+            stream_sink.reset(token)
+            await sink.get()
+            first.append(time.perf_counter() - start)
+            await task
+        await Demon.aclose()
+        return blocking, first
+
+    blocking, first = asyncio.run(run())
+    print(f"🌊 decompose_tasks time to first step ({runs} runs, 500 ms fake completion)")
+    print(f"   blocking:  {sorted(blocking)[runs // 2] * 1000:7.1f} ms (p50)")
+    print(f"   streaming: {sorted(first)[runs // 2] * 1000:7.1f} ms (p50)")
+
+
+def benchmark_prompt_tokens():
+    import LLMs
+    import prompts
+    from initstate import init_state
+    state = init_state("bench")
+    state["chat_history"] = ["User: I can't focus", "AI: Let's take one small step together."] * 3
+    LLMs.get_planning_context = lambda user_id=None: (10, [{"activity": "journal", "is_routine": True}])
+    samples = {
+        "intent": LLMs._intent_prompts("Help me clean my room"),
+        "decompose": LLMs._decompose_prompts("clean my room", LLMs.base_user_prompt),
+        "plan": LLMs._plan_prompts("laundry, email and the gym today", LLMs.base_user_prompt, 7),
+        "convo": LLMs._convo_prompts("I'm tired", LLMs.base_user_prompt, state),
+    }
+    print("🧮 estimated input tokens per call type")
+    for name, (system, user) in samples.items():
+        print(f"   {name:<10} {prompts.estimate_tokens(system) + prompts.estimate_tokens(user):5d}"
+              f"  (stable prefix {prompts.estimate_tokens(system)})")
+
+
+# held out from intentclf.SEED
+INTENT_BENCH_SET = [
+    ("help me write my cover letter", "task_decomposition"), ("let's do this", "task_decomposition"),
+    ("help me tidy the living room", "task_decomposition"), ("i need to finish my lab report", "task_decomposition"),
+    ("break down studying for biology", "task_decomposition"), ("walk me through filing my expenses", "task_decomposition"),
+    ("begin", "task_decomposition"), ("help me fold the laundry", "task_decomposition"),
+    ("plan my evening", "day_planning"), ("i have gym, groceries and homework today, plan it", "day_planning"),
+    ("schedule for tomorrow please", "day_planning"), ("organize my tasks for today", "day_planning"),
+    ("what should i do today?", "day_planning"), ("help me plan my weekend day", "day_planning"),
+    ("every morning i drink water and stretch", "routine_management"), ("i usually read before bed", "routine_management"),
+    ("remind me every friday to call grandma", "routine_management"), ("i meditate daily at 6", "routine_management"),
+    ("i'm more focused in the morning", "profile_update"), ("i have dyslexia", "profile_update"),
+    ("i prefer very small steps", "profile_update"), ("i get anxious with deadlines", "profile_update"),
+    ("my energy crashes after lunch", "profile_update"), ("i work better with voice", "profile_update"),
+    ("hey", "conversation"), ("i'm exhausted", "conversation"), ("why can't i do anything", "conversation"),
+    ("thank you", "conversation"), ("i feel overwhelmed", "conversation"), ("what is your name", "conversation"),
+    ("this is hard", "conversation"), ("good morning", "conversation"),
+    # chat that the n-gram model used to wave through as task_decomposition at 0.9+
+    ("my boss yelled at me", "conversation"), ("my cat knocked my mug over, whatever", "conversation"),
+    ("I finished my essay!", "conversation"), ("help me", "conversation"),
+    # a timed request: the fast path would drop the 5pm slot
+    ("I need to call my mom at 5pm tomorrow", "routine_management"),
+]
+
+
+def benchmark_intent_fast_path():
+    """Coverage/accuracy of the local classifier and its latency next to one LLM round-trip."""
+    from intentclf import IntentClassifier, INTENT_FAST_THRESHOLD
+    clf = IntentClassifier(log_path=None).train()
+
+    def local(threshold):
+        clf.threshold = threshold
+        answered = correct = 0
+        for text, label in INTENT_BENCH_SET:
+            slots = clf.fast_slots(text)
+            if slots is not None:
+                answered += 1
+                correct += slots["intent"] == label
+        return answered, correct
+
+    start = time.perf_counter()
+    answered, correct = local(INTENT_FAST_THRESHOLD)
+    local_us = (time.perf_counter() - start) / len(INTENT_BENCH_SET) * 1e6
+    sweep = {t: local(t) for t in (0.99, 0.95, 0.9, 0.8)}
+
+    real = os.getenv("BENCH_REAL_LLM")
+    if not real:
+        os.environ["LLM_BASE_URL"] = start_fake_llm_server('{"intent": "conversation"}')
+    os.environ.setdefault("API_KEY", "bench")
+    from LLMs import Demon, aextract_intent
+    from llmjson import parse_llm_json, IntentSlots
+
+    async def run():
+        model = Demon(cache=None)
+        hits, elapsed = 0, []
+        for text, label in INTENT_BENCH_SET:
+            t0 = time.perf_counter()
+            raw = await aextract_intent(text, model)
+            elapsed.append(time.perf_counter() - t0)
+            try:
+                hits += parse_llm_json(raw, IntentSlots)[0]["intent"] == label
+            except ValueError:
+                pass
+        await Demon.aclose()
+        return hits, sorted(elapsed)[len(elapsed) // 2]
+
+    llm_hits, llm_p50 = asyncio.run(run())
+    n = len(INTENT_BENCH_SET)
+    print(f"🎯 intent fast path ({n} labelled inputs, threshold {INTENT_FAST_THRESHOLD})")
+    print(f"   local: {answered}/{n} answered, {correct}/{answered or 1} correct, {local_us:9.1f} µs/input")
+    for t, (a, c) in sweep.items():
+        print(f"   threshold {t}: {a}/{n} answered, {a - c} wrong")
+    print(f"   llm:   {llm_hits}/{n} correct{'' if real else ' (fake server, BENCH_REAL_LLM=1 for Groq)'}, "
+          f"{llm_p50 * 1e6:9.0f} µs p50")
+
+
+def _route_fake_reply(request):
+    system = request["messages"][0]["content"]
+    if system.startswith("Classify"):
+        return '{"intent": "task_decomposition", "action": "clean my room"}'
+    return json.dumps({"steps": [{"text": "Pick up one thing", "difficulty": 2, "duration_minutes": 2}]})
+
+
+def benchmark_speculation(runs=10):
+    """Turn latency for an intent-then-decompose input, with and without speculation."""
+    os.environ["LLM_BASE_URL"] = start_fake_llm_server(_route_fake_reply, delay=0.2)
+    os.environ.setdefault("API_KEY", "bench")
+    import arch
+    import db
+    from LLMs import Demon, base_user_prompt
+    from initstate import init_state
+    from intentclf import get_classifier
+    db.init_db()
+    get_classifier().threshold = 1.01  # force the intent round-trip, the case speculation helps
+
+    async def run(speculate):
+        arch.SPECULATIVE_DECOMPOSE = speculate
+        model = Demon(cache=None)
+        elapsed = []
+        for i in range(runs):
+            event = {"type": "USER_INPUT", "payload": f"help me clean my room {i}"}
+            start = time.perf_counter()
+            await arch.ahandle_event(event, init_state(f"bench-{i}"), 7, model, base_user_prompt)
+            elapsed.append(time.perf_counter() - start)
+        await Demon.aclose()
+        return sorted(elapsed)[runs // 2]
+
+    sequential = asyncio.run(run(False))
+    speculative = asyncio.run(run(True))
+    print(f"🔮 intent + decompose turn ({runs} runs, 200 ms fake completions)")
+    print(f"   sequential:  {sequential * 1000:7.1f} ms (p50)")
+    print(f"   speculative: {speculative * 1000:7.1f} ms (p50)  {arch.speculation_rates()}")
+
+
+STARTUP_IMPORT_BUDGET_MS = float(os.getenv("STARTUP_IMPORT_BUDGET_MS", "2000"))
+STARTUP_FIRST_REQUEST_BUDGET_MS = float(os.getenv("STARTUP_FIRST_REQUEST_BUDGET_MS", "3000"))
+
+_FIRST_REQUEST_PROBE = """
+import time, sys
+start = time.perf_counter()
+sys.path.insert(0, {backend!r})
+from fastapi.testclient import TestClient
+import main
+with TestClient(main.app) as client:
+    client.get("/")
+    print((time.perf_counter() - start) * 1000)
+"""
+
+
+def benchmark_startup():
+    """Cold-start regression gate: exits non-zero if import or first request blow their budget."""
+    import subprocess
+    import tempfile
+    backend = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as scratch:
+        env = dict(os.environ, API_KEY=os.getenv("API_KEY", "bench"))
+        probe = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import sys; sys.path.insert(0, {backend!r}); import main"],
+                               cwd=scratch, env=env, capture_output=True, text=True, check=True)
+        main_line = [l for l in probe.stderr.splitlines() if l.rstrip().endswith("| main")][-1]
+        import_ms = int(main_line.split("|")[1]) / 1000
+        touched = sorted(os.listdir(scratch))
+        first = subprocess.run([sys.executable, "-c", _FIRST_REQUEST_PROBE.format(backend=backend)],
+                               cwd=scratch, env=env, capture_output=True, text=True, check=True)
+        first_ms = float(first.stdout.strip().splitlines()[-1])
+
+    print("🚀 cold start")
+    print(f"   import main:        {import_ms:8.1f} ms (budget {STARTUP_IMPORT_BUDGET_MS:.0f})")
+    print(f"   first request:      {first_ms:8.1f} ms (budget {STARTUP_FIRST_REQUEST_BUDGET_MS:.0f})")
+    print(f"   files made by import: {touched or 'none'}")
+    if touched or import_ms > STARTUP_IMPORT_BUDGET_MS or first_ms > STARTUP_FIRST_REQUEST_BUDGET_MS:
+        print("❌ startup regression")
+        sys.exit(1)
+
+
+BENCHMARKS = {
+    "llm": benchmark_llm_concurrency,
+    "db": benchmark_db_queries,
+    "decrypt": benchmark_decryption,
+    "energy": benchmark_energy_histogram,
+    "activity": benchmark_activity_stats,
+    "vision": benchmark_vision_ingest,
+    "visioncache": benchmark_vision_cache,
+    "stream": benchmark_stream_ttfb,
+    "startup": benchmark_startup,
+    "prompts": benchmark_prompt_tokens,
+    "intent": benchmark_intent_fast_path,
+    "speculation": benchmark_speculation,
+    "pii": benchmark_pii,
+    "sessions": benchmark_session_memory,
+    "schedule": benchmark_bulk_schedule,
+    "done": benchmark_done_latency,
+}
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        BENCHMARKS[name]()
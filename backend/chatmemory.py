@@ -0,0 +1,80 @@
+import os
+import asyncio
+import prompts
+
+# Convo sees the last few lines verbatim plus a rolling summary of everything older.
+# Lines that slide out of the verbatim window are folded into the summary by a background
+# LLM call after the reply has gone out, so neither the session nor the prompt grows.
+CHAT_RECENT_LINES = int(os.getenv("CHAT_RECENT_LINES", "6"))
+CHAT_SUMMARY_EVERY = int(os.getenv("CHAT_SUMMARY_EVERY", "8"))
+CHAT_MEMORY_TOKENS = int(os.getenv("CHAT_MEMORY_TOKENS", "400"))
+CHAT_SUMMARY_TOKENS = int(os.getenv("CHAT_SUMMARY_TOKENS", "150"))
+
+_running = {}  # id(state) -> summarizer task; one fold at a time per session
+memory_stats = {"summaries": 0, "failed": 0, "lines_folded": 0}
+
+
+def _clip(text, tokens):
+    limit = tokens * 4
+    return text if len(text) <= limit else text[:limit - 1].rstrip() + "…"
+
+
+def remember(state, *lines):
+    """Appends to the ring buffer, keeping an absolute line count so folds line up after drops."""
+    state['chat_history'].extend(lines)
+    state['chat_lines_total'] = state.get('chat_lines_total', 0) + len(lines)
+
+
+def context(state, budget=CHAT_MEMORY_TOKENS):
+    """(summary, recent lines) for the prompt, together within `budget` tokens."""
+    # verbatim lines get up to 3/4 of the budget (oldest dropped first), the summary the rest
+    recent = [_clip(line, budget * 3 // 8) for line in list(state.get('chat_history') or ())[-CHAT_RECENT_LINES:]]
+    used = sum(prompts.estimate_tokens(line) for line in recent)
+    while len(recent) > 2 and used > budget * 3 // 4:
+        used -= prompts.estimate_tokens(recent.pop(0))
+    summary = state.get('chat_summary') or ""
+    return (_clip(summary, budget - used) if summary else ""), recent
+
+
+def _unfolded(state):
+    # lines still in the buffer that are older than the verbatim window
+    return list(state['chat_history'])[:-CHAT_RECENT_LINES] if len(state['chat_history']) > CHAT_RECENT_LINES else []
+
+
+async def _fold(state, model, lines, end):
+    try:
+        system, user = prompts.summary(state.get('chat_summary') or "", lines)
+        summary = _clip((await model.agenerate(system, user)).strip(), CHAT_SUMMARY_TOKENS)
+    except Exception as e:
+        memory_stats["failed"] += 1
+        print(f"❌ Chat summary failed: {e}")
+        return
+    history = state['chat_history']
+    first = state['chat_lines_total'] - len(history)
+    while history and first < end:
+        history.popleft()
+        first += 1
+    state['chat_summary'] = summary
+    memory_stats["summaries"] += 1
+    memory_stats["lines_folded"] += len(lines)
+    print(f"🧠 Folded {len(lines)} chat lines into the summary ({prompts.estimate_tokens(summary)} tokens)")
+
+
+def maybe_summarize(state, model):
+    """Starts a background fold once enough lines have left the verbatim window."""
+    lines = _unfolded(state)
+    if len(lines) < CHAT_SUMMARY_EVERY or id(state) in _running:
+        return None
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return None  # sync callers keep the plain ring buffer
+    end = state['chat_lines_total'] - CHAT_RECENT_LINES
+    task = loop.create_task(_fold(state, model, lines, end))
+    _running[id(state)] = task
+    task.add_done_callback(lambda _: _running.pop(id(state), None))
+    return task
+
+
+def chat_memory_stats():
+    return dict(memory_stats, running=len(_running))
@@ -1,26 +1,214 @@
 import sqlite3
 import os
+import heapq
+import hashlib
+import threading
+import time
+from collections import OrderedDict
 from cryptography.fernet import Fernet
+from jobs import jobs, after_commit
 import json
 from datetime import datetime, timedelta
 
-SECRET_KEY_ENV = os.getenv("SECRET_KEY")
+_cipher = None
+_index_key = None
 
-if SECRET_KEY_ENV:
-    # Use the key from Render's Environment Variables
-    SECRET_KEY = SECRET_KEY_ENV.encode() 
-elif os.path.exists("secret.key"):
-    with open("secret.key", "rb") as f:
-        SECRET_KEY = f.read()
-else:
-    SECRET_KEY = Fernet.generate_key()
-    with open("secret.key", "wb") as f:
-        f.write(SECRET_KEY)
+def get_cipher():
+    """Fernet for encryption at rest; the key file is only touched the first time it's needed."""
+    global _cipher, _index_key
+    if _cipher is None:
+        secret_key_env = os.getenv("SECRET_KEY")
+        if secret_key_env:
+            # Use the key from Render's Environment Variables
+            secret_key = secret_key_env.encode() 
+        elif os.path.exists("secret.key"):
+            with open("secret.key", "rb") as f:
+                secret_key = f.read()
+        else:
+            secret_key = Fernet.generate_key()
+            with open("secret.key", "wb") as f:
+                f.write(secret_key)
+        _cipher = Fernet(secret_key)
+        # keyed hash for lookup columns, so they don't reveal what the encrypted payload says
+        _index_key = hashlib.blake2b(secret_key, digest_size=32, person=b"index-key").digest()
+    return _cipher
 
-cipher = Fernet(SECRET_KEY)
+DB_PATH = os.getenv("DB_PATH", "database.db")
+ENERGY_HALF_LIFE_DAYS = float(os.getenv("ENERGY_HALF_LIFE_DAYS", "14"))
+DECRYPT_CACHE_SIZE = int(os.getenv("DECRYPT_CACHE_SIZE", "50000"))
+# Also store activity / is_routine / difficulty in plain, indexed columns so filters and the
+# planner never decrypt. Off by default: it trades some at-rest privacy for speed.
+DB_PLAINTEXT_METADATA = os.getenv("DB_PLAINTEXT_METADATA", "0").lower() in ("1", "true", "yes")
+# How often a worker asks whether another worker changed task_queue (see _sync_due)
+DUE_SYNC_SECONDS = float(os.getenv("DUE_SYNC_SECONDS", "1"))
+
+_local = threading.local()
+
+def get_conn():
+    """One long-lived connection per thread, tuned once when it is opened."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(DB_PATH, cached_statements=256)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA cache_size=-16000")
+        conn.execute("PRAGMA mmap_size=268435456")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA busy_timeout=5000")
+        _local.conn = conn
+    return conn
+
+def close_conn():
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+# Decrypted rows keyed by (table, row id) and remembered together with a digest of the
+# ciphertext they came from, so a row rewritten behind our back is never served stale.
+# Values are shared between callers; treat them as read-only.
+_decrypted = OrderedDict()
+_decrypted_lock = threading.Lock()
+decrypt_stats = {"hits": 0, "misses": 0}
+
+def _digest(blob):
+    return hashlib.blake2b(blob, digest_size=16).digest()
+
+def decrypt_rows(table, rows, parse=None):
+    """
+    Bulk decrypt [(row_id, ciphertext), ...] in order, decrypting only cache misses.
+    parse turns the plaintext str into the cached value (e.g. json.loads).
+    """
+    out, misses = [], []
+    with _decrypted_lock:
+        for row_id, blob in rows:
+            key = (table, row_id)
+            entry = _decrypted.get(key)
+            if entry is not None and entry[0] == _digest(blob):
+                _decrypted.move_to_end(key)
+                out.append(entry[1])
+            else:
+                misses.append(len(out))
+                out.append(None)
+        decrypt_stats["hits"] += len(rows) - len(misses)
+        decrypt_stats["misses"] += len(misses)
+    if not misses:
+        return out
+    cipher = get_cipher()
+    fresh = []
+    for i in misses:
+        row_id, blob = rows[i]
+        value = cipher.decrypt(blob).decode()
+        out[i] = parse(value) if parse else value
+        fresh.append(((table, row_id), (_digest(blob), out[i])))
+    with _decrypted_lock:
+        _decrypted.update(fresh)
+        for key, _ in fresh:
+            _decrypted.move_to_end(key)
+        while len(_decrypted) > DECRYPT_CACHE_SIZE:
+            _decrypted.popitem(last=False)
+    return out
+
+def forget_decrypted(table, row_id):
+    with _decrypted_lock:
+        _decrypted.pop((table, row_id), None)
+
+def _metadata(task_data):
+    # is_routine was always meant to live in its own column; names and difficulty are opt-in
+    is_routine = bool(task_data.get("is_routine"))
+    if not DB_PLAINTEXT_METADATA:
+        return None, None, is_routine
+    return task_data.get("activity"), task_data.get("difficulty"), is_routine
+
+# Pending task_queue rows live in per-session min-heaps of (scheduled_timestamp, id) so a
+# heartbeat can see whether anything is due without touching the database.
+# Heap entries are dropped lazily once their id leaves _due_index (status changed).
+# The heaps are per process, so every task_queue write also bumps due_version in the same
+# transaction; a worker that finds a version it didn't write itself reloads its heaps.
+# _released holds ids whose new status is still waiting on its background write, so a
+# reload in that window doesn't bring the still-'pending' row back.
+_due_heaps = {}
+_due_index = {}
+_released = set()
+_due_lock = threading.Lock()
+_due_seen = -1
+_due_checked = 0.0
+
+def _ist_window():
+    now_dt = datetime.utcnow() + timedelta(hours=5, minutes=30)
+    return now_dt.strftime("%Y-%m-%d %H:%M"), (now_dt - timedelta(minutes=10)).strftime("%Y-%m-%d %H:%M")
+
+def _track_due(task_id, start_time, session_id):
+    if not start_time or task_id in _released:
+        return
+    _due_index[task_id] = session_id
+    heapq.heappush(_due_heaps.setdefault(session_id, []), (start_time, task_id))
+
+def _bump_due_version(conn):
+    return conn.execute("UPDATE due_version SET version = version + 1 RETURNING version").fetchone()[0]
+
+def _adopt_due_version(version):
+    # our own write, and nobody else wrote in between: the heaps already reflect it
+    global _due_seen
+    if version == _due_seen + 1:
+        _due_seen = version
+
+def _sync_due():
+    global _due_checked
+    now = time.monotonic()
+    if now - _due_checked < DUE_SYNC_SECONDS:
+        return
+    _due_checked = now
+    try:
+        row = get_conn().execute("SELECT version FROM due_version").fetchone()
+    except sqlite3.OperationalError:
+        return  # init_db hasn't run in this database yet, so there is nothing to follow
+    if row and row[0] != _due_seen:
+        load_due_tasks()
+
+def load_due_tasks():
+    global _due_seen
+    _, ten_mins_ago = _ist_window()
+    conn = get_conn()
+    # read and rebuild under the lock, so a local write can't track its rows in between and
+    # then be wiped; the version is read first, a foreign write in between costs one more reload
+    with _due_lock:
+        version = conn.execute("SELECT version FROM due_version").fetchone()[0]
+        rows = conn.execute("""
+            SELECT id, scheduled_timestamp, session_id FROM task_queue
+            WHERE (status = 'pending' OR status IS NULL OR status = '')
+            AND scheduled_timestamp >= ?
+        """, (ten_mins_ago,)).fetchall()
+        _due_heaps.clear()
+        _due_index.clear()
+        for task_id, start_time, session_id in rows:
+            _track_due(task_id, start_time, session_id)
+        _due_seen = version
+
+def _peek_due(session_id, ten_mins_ago):
+    heap = _due_heaps.get(session_id)
+    while heap:
+        start_time, task_id = heap[0]
+        if task_id not in _due_index:
+            heapq.heappop(heap)
+        elif start_time < ten_mins_ago:
+            # missed its window, same as the old BETWEEN range never matching it again
+            heapq.heappop(heap)
+            del _due_index[task_id]
+        else:
+            return start_time, task_id
+    return None
+
+def next_due_at(session_id=None):
+    """Earliest pending start time visible to a session (its own tasks plus unowned ones)."""
+    _, ten_mins_ago = _ist_window()
+    _sync_due()
+    with _due_lock:
+        candidates = [e for e in (_peek_due(session_id, ten_mins_ago), _peek_due(None, ten_mins_ago)) if e]
+    return min(candidates)[0] if candidates else None
 
 def init_db():
-    conn = sqlite3.connect('database.db')
+    conn = get_conn()
     cursor = conn.cursor()
 
     cursor.execute('CREATE TABLE IF NOT EXISTS profiles (user_id TEXT PRIMARY KEY, data BLOB)')
@@ -44,114 +232,386 @@ def init_db():
     try:
         cursor.execute("ALTER TABLE task_queue ADD COLUMN is_routine BOOLEAN DEFAULT 0")
     except sqlite3.OperationalError: pass
+
+    try:
+        cursor.execute("ALTER TABLE task_queue ADD COLUMN session_id TEXT")
+    except sqlite3.OperationalError: pass
+
+    for column in ("activity TEXT", "difficulty INTEGER", "task_key TEXT", "origin TEXT"):
+        try:
+            cursor.execute(f"ALTER TABLE task_queue ADD COLUMN {column}")
+        except sqlite3.OperationalError: pass
+
+    try:
+        cursor.execute("ALTER TABLE routines ADD COLUMN difficulty INTEGER")
+    except sqlite3.OperationalError: pass
+
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_task_queue_due ON task_queue (status, scheduled_timestamp)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_task_queue_activity ON task_queue (activity)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_task_queue_routine ON task_queue (is_routine, status)')
+    # one row per (session, activity, start_time); rows scheduled before keys existed stay NULL
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_task_queue_key ON task_queue (task_key)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_task_queue_origin ON task_queue (session_id, origin, status)')
     
+    cursor.execute('CREATE TABLE IF NOT EXISTS due_version (id INTEGER PRIMARY KEY CHECK (id = 1), version INTEGER NOT NULL)')
+    cursor.execute('INSERT OR IGNORE INTO due_version VALUES (1, 0)')
+
     cursor.execute('CREATE TABLE IF NOT EXISTS history (id INTEGER PRIMARY KEY AUTOINCREMENT, task_name TEXT, energy_level INTEGER, timestamp DATETIME)')
+
+    try:
+        cursor.execute("ALTER TABLE history ADD COLUMN user_id TEXT")
+    except sqlite3.OperationalError: pass
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS energy_histogram (
+        user_id TEXT,
+        weekday INTEGER,
+        hour INTEGER,
+        weight REAL DEFAULT 0,
+        total REAL DEFAULT 0,
+        PRIMARY KEY (user_id, weekday, hour)
+    )''')
     
     cursor.execute('CREATE TABLE IF NOT EXISTS sessions (session_id TEXT PRIMARY KEY, state_blob BLOB)')
 
+    try:
+        cursor.execute("ALTER TABLE sessions ADD COLUMN version INTEGER DEFAULT 0")
+    except sqlite3.OperationalError: pass
+
     conn.commit()
-    conn.close()
+    if DB_PLAINTEXT_METADATA:
+        backfill_routine_metadata()
+    if conn.execute("SELECT 1 FROM energy_histogram LIMIT 1").fetchone() is None:
+        rebuild_energy_histogram()
+    load_due_tasks()
     print("✅ Database Initialized, Encrypted at Rest, and Persistence Verified.")
 
-init_db()
 
 
-def get_planning_context():
-    conn = sqlite3.connect('database.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT STRFTIME('%H', timestamp) as hr, AVG(energy_level) FROM history GROUP BY hr ORDER BY 2 DESC LIMIT 1")
-    row = cursor.fetchone()
-    peak = f"{row[0]}:00" if row else "10:00 AM"
+# Bio-rhythm: running (weight, energy total) per user, weekday and hour, kept up to date by
+# log_task_completion so planning never scans `history`. Weekday -1 is "any day" and user
+# "*" is everyone. Decay uses forward decay: a sample at time t counts 2^((t - epoch)/half-life),
+# so recent samples dominate, averages are unchanged by the common scale, and every update
+# is a plain atomic add (weights stay finite for decades at a 14-day half-life). Changing
+# ENERGY_HALF_LIFE_DAYS needs rebuild_energy_histogram().
+_ENERGY_EPOCH = datetime(2024, 1, 1)
+ALL_USERS = "*"
+ANY_DAY = -1
+
+def _energy_weight(when):
+    return 2.0 ** ((when - _ENERGY_EPOCH).total_seconds() / (ENERGY_HALF_LIFE_DAYS * 86400))
+
+def _energy_rows(user_id, energy, when):
+    weight = _energy_weight(when)
+    users = {ALL_USERS, user_id or ALL_USERS}
+    return [(u, day, when.hour, weight, weight * energy) for u in users for day in (ANY_DAY, when.weekday())]
+
+_ENERGY_UPSERT = """
+    INSERT INTO energy_histogram (user_id, weekday, hour, weight, total) VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(user_id, weekday, hour) DO UPDATE SET
+        weight = weight + excluded.weight, total = total + excluded.total
+"""
+
+def rebuild_energy_histogram():
+    """Recompute the histogram from `history` (first start after upgrading, or a new half-life)."""
+    conn = get_conn()
+    buckets = {}
+    for user_id, energy, stamp in conn.execute("SELECT user_id, energy_level, timestamp FROM history WHERE energy_level IS NOT NULL"):
+        try:
+            when = datetime.fromisoformat(stamp)
+        except (TypeError, ValueError):
+            continue
+        for user, day, hour, weight, total in _energy_rows(user_id, energy, when):
+            bucket = buckets.setdefault((user, day, hour), [0.0, 0.0])
+            bucket[0] += weight
+            bucket[1] += total
+    with conn:
+        conn.execute("DELETE FROM energy_histogram")
+        conn.executemany(_ENERGY_UPSERT, [key + tuple(bucket) for key, bucket in buckets.items()])
+
+def energy_curve(user_id=None, weekday=ANY_DAY):
+    """24 entries of (hour, average energy or None, sample weight decayed to now)."""
+    rows = get_conn().execute("SELECT hour, weight, total FROM energy_histogram WHERE user_id = ? AND weekday = ?",
+                              (user_id or ALL_USERS, weekday)).fetchall()
+    now_weight = _energy_weight(datetime.now())
+    curve = [(hour, None, 0.0) for hour in range(24)]
+    for hour, weight, total in rows:
+        if weight:
+            curve[hour] = (hour, total / weight, weight / now_weight)
+    return curve
+
+def peak_focus_hour(user_id=None, weekday=ANY_DAY):
+    """Hour with the highest average energy, falling back to everyone's curve; O(24)."""
+    for who in dict.fromkeys((user_id or ALL_USERS, ALL_USERS)):
+        scored = [(avg, hour) for hour, avg, _ in energy_curve(who, weekday) if avg is not None]
+        if scored:
+            return max(scored)[1]
+    return None
+
+
+def get_planning_context(user_id=None):
+    hour = peak_focus_hour(user_id)
+    peak = f"{hour:02d}:00" if hour is not None else "10:00 AM"
     
-    cursor.execute("SELECT data FROM routines")
-    routines = [json.loads(cipher.decrypt(r[0]).decode()) for r in cursor.fetchall()]
-    conn.close()
-    return peak, routines
+    return peak, get_routines()
+
+
+def get_routines():
+    """
+    Routines for the planner. With DB_PLAINTEXT_METADATA the metadata columns are enough
+    and nothing is decrypted; otherwise rows go through the decrypted-object cache.
+    """
+    conn = get_conn()
+    if DB_PLAINTEXT_METADATA:
+        # rows saved while the flag was off (or without an activity) still need their blob
+        rows = conn.execute("SELECT id, name, difficulty, CASE WHEN name IS NULL THEN data END FROM routines").fetchall()
+        legacy = iter(decrypt_rows("routines", [(rid, data) for rid, name, _, data in rows if name is None],
+                                   parse=json.loads))
+        return [next(legacy) if name is None else {"activity": name, "difficulty": difficulty, "is_routine": True}
+                for _, name, difficulty, _ in rows]
+    return decrypt_rows("routines", conn.execute("SELECT id, data FROM routines").fetchall(), parse=json.loads)
+
+
+def backfill_routine_metadata():
+    """Fills name/difficulty for routines saved before DB_PLAINTEXT_METADATA was turned on."""
+    conn = get_conn()
+    rows = conn.execute("SELECT id, data FROM routines WHERE name IS NULL").fetchall()
+    if not rows:
+        return 0
+    routines = decrypt_rows("routines", rows, parse=json.loads)
+    updates = [(activity, difficulty, rid) for (rid, _), (activity, difficulty, _) in
+               zip(rows, map(_metadata, routines)) if activity is not None]
+    with conn:
+        conn.executemany("UPDATE routines SET name = ?, difficulty = ? WHERE id = ?", updates)
+    print(f"🧬 Backfilled plaintext metadata for {len(updates)} routine(s)")
+    return len(updates)
+
+
+def save_routine(routine, routine_id=None):
+    encrypted = get_cipher().encrypt(json.dumps(routine).encode())
+    activity, difficulty, _ = _metadata(routine)
+    with get_conn() as conn:
+        if routine_id is None:
+            routine_id = conn.execute("INSERT INTO routines (name, difficulty, data) VALUES (?, ?, ?)",
+                                      (activity, difficulty, encrypted)).lastrowid
+        else:
+            conn.execute("UPDATE routines SET name = ?, difficulty = ?, data = ? WHERE id = ?",
+                         (activity, difficulty, encrypted, routine_id))
+    forget_decrypted("routines", routine_id)
+    return routine_id
 
 
 def save_profile(user_id, profile_dict):
-    conn = sqlite3.connect('database.db')
-    encrypted_data = cipher.encrypt(json.dumps(profile_dict).encode())
+    encrypted_data = get_cipher().encrypt(json.dumps(profile_dict).encode())
     
-    conn.execute("INSERT OR REPLACE INTO profiles (user_id, data) VALUES (?, ?)", 
-                 (user_id, encrypted_data))
-    conn.commit()
-    conn.close()
+    with get_conn() as conn:
+        conn.execute("INSERT OR REPLACE INTO profiles (user_id, data) VALUES (?, ?)", 
+                     (user_id, encrypted_data))
 
 def get_profile(user_id):
-    conn = sqlite3.connect('database.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT data FROM profiles WHERE user_id = ?", (user_id,))
-    row = cursor.fetchone()
-    conn.close()
+    row = get_conn().execute("SELECT data FROM profiles WHERE user_id = ?", (user_id,)).fetchone()
     
     if row:
-        decrypted_data = cipher.decrypt(row[0]).decode()
+        decrypted_data = get_cipher().decrypt(row[0]).decode()
         return json.loads(decrypted_data)
     return None
 
-def log_task_completion(task_name, energy):
-    conn = sqlite3.connect('database.db')
-    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    conn.execute("INSERT INTO history (task_name, energy_level, timestamp) VALUES (?, ?, ?)", 
-                 (task_name, energy, now))
-    conn.commit()
-    conn.close()
+def save_sessions(snapshots):
+    """
+    Compare-and-swap write of encrypted session blobs in one transaction.
+    snapshots: {session_id: (state snapshot bytes, expected version)}. Returns the ids whose
+    stored version had moved on (another worker won); those rows are left untouched.
+    """
+    conflicts = []
+    with get_conn() as conn:
+        for sid, (blob, expected) in snapshots.items():
+            sealed = get_cipher().encrypt(blob)
+            cur = conn.execute("UPDATE sessions SET state_blob = ?, version = version + 1 WHERE session_id = ? AND version = ?",
+                               (sealed, sid, expected))
+            if cur.rowcount == 0 and expected == 0:
+                cur = conn.execute("INSERT OR IGNORE INTO sessions (session_id, state_blob, version) VALUES (?, ?, 1)",
+                                   (sid, sealed))
+            if cur.rowcount == 0:
+                conflicts.append(sid)
+    return conflicts
+
+def get_session(session_id):
+    """Returns (decrypted state snapshot, version) or None."""
+    row = get_conn().execute("SELECT state_blob, version FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+    if row:
+        return get_cipher().decrypt(row[0]), row[1] or 0
+    return None
 
+def get_session_version(session_id):
+    row = get_conn().execute("SELECT version FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+    return (row[0] or 0) if row else 0
 
+def delete_session(session_id):
+    with get_conn() as conn:
+        conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
 
-def schedule_future_task(start_time, task_data):
-    conn = sqlite3.connect('database.db')
-    encrypted_task = cipher.encrypt(json.dumps(task_data).encode())
-    
-    conn.execute(""" 
-        INSERT INTO task_queue (scheduled_timestamp, status, encrypted_payload) 
-        VALUES (?, 'pending', ?)
-    """, (start_time, encrypted_task))
-    
-    conn.commit()
-    conn.close()
+def log_task_completion(task_name, energy, user_id=None):
+    jobs.submit_after_commit(_record_completion, task_name, energy, user_id, datetime.now())
 
+def _record_completion(task_name, energy, user_id, when):
+    now = when.strftime("%Y-%m-%d %H:%M:%S")
+    with get_conn() as conn:
+        conn.execute("INSERT INTO history (task_name, energy_level, timestamp, user_id) VALUES (?, ?, ?, ?)", 
+                     (task_name, energy, now, user_id))
+        if energy is not None:
+            conn.executemany(_ENERGY_UPSERT, _energy_rows(user_id, energy, when))
 
-def check_for_scheduled_tasks():
-    conn = sqlite3.connect('database.db')
-    cursor = conn.cursor()
-    
-    now_dt = datetime.utcnow() + timedelta(hours=5, minutes=30)
-    now_str = now_dt.strftime("%Y-%m-%d %H:%M")
-    
-    ten_mins_ago = (now_dt - timedelta(minutes=10)).strftime("%Y-%m-%d %H:%M")
-
-    cursor.execute("""
-        SELECT id, encrypted_payload 
-        FROM task_queue 
-        WHERE (scheduled_timestamp BETWEEN ? AND ?)
-        AND (status = 'pending' OR status IS NULL OR status = '')
-        ORDER BY scheduled_timestamp ASC
-        LIMIT 1
-    """, (ten_mins_ago, now_str)) 
-
-    row = cursor.fetchone()
-    conn.close()
+
+
+def task_key(session_id, activity, start_time):
+    get_cipher()
+    text = json.dumps([session_id, activity, start_time])
+    return hashlib.blake2b(text.encode(), digest_size=16, key=_index_key).hexdigest()
+
+
+# Re-scheduling an existing key refreshes its payload while it is still pending (or brings it
+# back if an earlier re-plan superseded it) and leaves finished rows alone, so repeating a plan
+# never stacks duplicates or revives done tasks.
+_SCHEDULE_UPSERT = """
+    INSERT INTO task_queue (scheduled_timestamp, status, encrypted_payload, session_id, activity, difficulty,
+                            is_routine, task_key, origin)
+    VALUES (?, 'pending', ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(task_key) DO UPDATE SET
+        encrypted_payload = excluded.encrypted_payload,
+        activity = excluded.activity,
+        difficulty = excluded.difficulty,
+        is_routine = excluded.is_routine,
+        origin = excluded.origin,
+        status = 'pending'
+    WHERE status IN ('pending', 'superseded')
+"""
+
+
+def schedule_tasks(items, session_id=None, origin=None, replace=False):
+    """
+    Schedules [(start_time, task_data), ...] in one transaction and returns their row ids.
+    With replace=True this is a re-plan: pending rows of the same session and origin on the
+    days the new items cover, but not among them, are marked 'superseded' in the same
+    transaction, so readers see the old plan or the new one, never a mix.
+    """
+    cipher = get_cipher()
+    rows, keys = [], []
+    for start_time, task_data in items:
+        key = task_key(session_id, task_data.get("activity"), start_time)
+        if key in keys:
+            continue
+        activity, difficulty, is_routine = _metadata(task_data)
+        keys.append(key)
+        rows.append((start_time, cipher.encrypt(json.dumps(task_data).encode()), session_id,
+                     activity, difficulty, is_routine, key, origin))
+    if not rows:
+        return []
+
+    marks = ",".join("?" * len(keys))
+    days = sorted({str(r[0])[:10] for r in rows if r[0]})
+    superseded = []
+    with get_conn() as conn:
+        conn.executemany(_SCHEDULE_UPSERT, rows)
+        if replace and days:
+            superseded = [r[0] for r in conn.execute(f"""
+                UPDATE task_queue SET status = 'superseded'
+                WHERE session_id IS ? AND origin IS ? AND status = 'pending'
+                AND substr(scheduled_timestamp, 1, 10) IN ({",".join("?" * len(days))})
+                AND (task_key IS NULL OR task_key NOT IN ({marks}))
+                RETURNING id
+            """, (session_id, origin, *days, *keys)).fetchall()]
+        version = _bump_due_version(conn)
+        found = {key: (task_id, start, status) for task_id, key, start, status in conn.execute(
+            f"SELECT id, task_key, scheduled_timestamp, status FROM task_queue WHERE task_key IN ({marks})", keys)}
+
+    with _due_lock:
+        for task_id in superseded:
+            _due_index.pop(task_id, None)
+        for task_id, start, status in found.values():
+            if status == 'pending' and task_id not in _due_index:
+                _track_due(task_id, start, session_id)
+        _adopt_due_version(version)
+    for task_id in superseded:
+        forget_decrypted("task_queue", task_id)
+    if superseded:
+        print(f"♻️ Re-plan superseded {len(superseded)} pending task(s) for {session_id}")
+    return [found[key][0] for key in keys]
+
+
+def schedule_future_task(start_time, task_data, session_id=None):
+    return schedule_tasks([(start_time, task_data)], session_id)[0]
+
+
+def check_for_scheduled_tasks(session_id=None):
+    now_str, ten_mins_ago = _ist_window()
+    _sync_due()
+    with _due_lock:
+        due = [e for e in (_peek_due(session_id, ten_mins_ago), _peek_due(None, ten_mins_ago))
+               if e and e[0] <= now_str]
+    if not due:
+        return None
+
+    task_id = min(due)[1]
+    row = get_conn().execute("SELECT encrypted_payload FROM task_queue WHERE id = ?", (task_id,)).fetchone()
     if row:
-        return row[0], cipher.decrypt(row[1]).decode()
+        return task_id, decrypt_rows("task_queue", [(task_id, row[0])])[0]
     return None
 
 
+def find_tasks(status="pending", is_routine=None, activity=None):
+    """(id, scheduled_timestamp, activity, difficulty) by the plaintext metadata columns; no decryption."""
+    query = "SELECT id, scheduled_timestamp, activity, difficulty FROM task_queue WHERE status = ?"
+    params = [status]
+    if is_routine is not None:
+        query += " AND is_routine = ?"
+        params.append(bool(is_routine))
+    if activity is not None:
+        query += " AND activity = ?"
+        params.append(activity)
+    return get_conn().execute(query + " ORDER BY scheduled_timestamp", params).fetchall()
+
+
+def _write_status(task_id, new_status):
+    with get_conn() as conn:
+        conn.execute("UPDATE task_queue SET status = ? WHERE id = ?", (new_status, task_id))
+        version = _bump_due_version(conn)
+    with _due_lock:
+        _released.discard(task_id)
+        _adopt_due_version(version)
+    print(f"✅ DB: Task {task_id} updated to {new_status}")
+
+
+def _release_task(task_id, new_status):
+    if new_status != 'pending':
+        with _due_lock:
+            _due_index.pop(task_id, None)
+        forget_decrypted("task_queue", task_id)
+
+
 def update_db_status(task_id, new_status):
-    conn = sqlite3.connect('database.db')
     try:
-        conn.execute("UPDATE task_queue SET status = ? WHERE id = ?", (new_status, task_id))
-        conn.commit()
-        print(f"✅ DB: Task {task_id} updated to {new_status}")
+        _write_status(task_id, new_status)
+        _release_task(task_id, new_status)
     except Exception as e:
         print(f"❌ DB Error: {e}")
-    finally:
-        conn.close()
+
+
+def queue_status_update(task_id, new_status):
+    """For the request path: the task stops being due right away, the row is written in the background."""
+    _release_task(task_id, new_status)
+    after_commit(_write_released, task_id, new_status)
+
+
+def _write_released(task_id, new_status):
+    if new_status != 'pending':
+        with _due_lock:
+            _released.add(task_id)
+            _due_index.pop(task_id, None)
+    jobs.submit(_write_status, task_id, new_status)
 
 
 def rescue_database():
-    conn = sqlite3.connect('database.db')
+    conn = get_conn()
     conn.execute("UPDATE task_queue SET status = 'pending' WHERE status IS NULL")
     cursor = conn.execute("SELECT id, scheduled_timestamp, status FROM task_queue WHERE status = 'pending'")
     rows = cursor.fetchall()
@@ -159,13 +619,15 @@ def rescue_database():
     for r in rows:
         print(f"ID: {r[0]} | Time: {r[1]} | Status: {r[2]}")
     print("-----------------------------------")
+    _bump_due_version(conn)
     conn.commit()
-    conn.close()
+    load_due_tasks()
 
 
 def clear_broken_tasks():
-    conn = sqlite3.connect('database.db')
-    conn.execute("DELETE FROM task_queue WHERE scheduled_timestamp IS NULL")
-    conn.commit()
-    conn.close()
+    with get_conn() as conn:
+        conn.execute("DELETE FROM task_queue WHERE scheduled_timestamp IS NULL")
+        _bump_due_version(conn)
+    with _decrypted_lock:
+        _decrypted.clear()
     print("🧹 Nuked the 'None' tasks.")
@@ -1,10 +1,16 @@
-import sqlite3
+import os
+import asyncio
+import threading
+from collections import OrderedDict
 from datetime import datetime,timedelta
 from render import render
 from initstate import init_state
+from db import get_conn, log_task_completion
+from activity import init_activity_db, log_activity
+from jobs import jobs, after_commit
 
 def init_gamification_db():
-    conn = sqlite3.connect('database.db')
+    conn = get_conn()
     cursor = conn.cursor()
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS user_stats (
@@ -14,14 +20,17 @@ def init_gamification_db():
         last_completion_date TEXT
     )''')
     conn.commit()
-    conn.close()
+    init_activity_db()
 
-def advance_step(state):
+def advance_step(state, stats=None):
+    # stats: the user's current stats when an async caller already read them off the loop
     if not state.get("active_steps"):
         return {"type": "chat", "text": "No active tasks to advance."}
 
     # Increment index
     state["current_step_index"] += 1
+    user_id = state.get("session_id") or "default_user"
+    log_activity(user_id, "step_completed")
 
     if state["current_step_index"] >= len(state["active_steps"]):
         steps = state['active_steps']
@@ -30,12 +39,18 @@ def advance_step(state):
         else:
             avg_diff = sum(s.get('difficulty', 5) for s in steps) / len(steps)
         
-        rewards = process_rewards("default_user", avg_diff)
+        # the response shows the award now; the ledger takes it once the turn commits
+        rewards = ledger.preview(user_id, avg_diff, stats)
+        after_commit(process_rewards, user_id, avg_diff)
+        log_activity(user_id, "task_completed", rewards["gained_xp"])
+        task_name = state.get("active_task") or steps[0].get("text") or "task"
+        log_task_completion(task_name, state.get("last_energy_level"), state.get("session_id"))
         
         # 3. Clear the task state
         state["active_steps"] = None
         state["current_step_index"] = 0
         state["active_task_intent"] = None
+        state["active_task"] = None
         
         if state.get('routine_buffer'):
             state['pending_task_from_db'] = state['routine_buffer']
@@ -53,47 +68,181 @@ def advance_step(state):
     return render("show_step", state)
 
 
-def process_rewards(user_id, task_difficulty):
-    conn = sqlite3.connect('database.db')
-    cursor = conn.cursor()
-    
-    gained_xp = int(task_difficulty * 10)
-    
-    today = datetime.now().strftime("%Y-%m-%d")
-    yesterday = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
-    
-    cursor.execute("SELECT xp, streak_count, last_completion_date FROM user_stats WHERE user_id = ?", (user_id,))
-    row = cursor.fetchone()
-    
-    if not row:
-        cursor.execute("INSERT INTO user_stats (user_id, xp, streak_count, last_completion_date) VALUES (?, ?, ?, ?)",
-                       (user_id, gained_xp, 1, today))
-        new_xp, new_streak = gained_xp, 1
-    else:
-        current_xp, current_streak, last_date = row
-        new_xp = current_xp + gained_xp
-        
-        if last_date == yesterday:
-            new_streak = current_streak + 1
-        elif last_date == today:
-            new_streak = current_streak 
-        else:
-            new_streak = 1 
-            
-        cursor.execute("UPDATE user_stats SET xp = ?, streak_count = ?, last_completion_date = ? WHERE user_id = ?",
-                       (new_xp, new_streak, today, user_id))
-    
-    conn.commit()
-    conn.close()
-    
+# 0 = every award is written through (by the background job queue while the app is serving);
+# > 0 = awards are applied to the in-memory stats at once and UPSERTed in batches by
+# run_flusher(). Either way advance_step doesn't wait on the disk once the app is up.
+REWARDS_FLUSH_SECONDS = float(os.getenv("REWARDS_FLUSH_SECONDS", "0"))
+# Users whose stats are kept in memory (LRU). Other workers write user_stats too, so cached
+# stats are refreshed from the row each flush returns; users with unflushed awards stay put.
+REWARDS_CACHE_SIZE = int(os.getenv("REWARDS_CACHE_SIZE", "10000"))
+
+# One statement per award: XP adds up and the streak follows the same rules as before
+# (yesterday -> +1, today -> unchanged, otherwise restart at 1), so concurrent awards can't
+# lose each other's updates.
+_REWARD_UPSERT = """
+    INSERT INTO user_stats (user_id, xp, streak_count, last_completion_date) VALUES (?, ?, 1, ?)
+    ON CONFLICT(user_id) DO UPDATE SET
+        xp = xp + excluded.xp,
+        streak_count = CASE
+            WHEN last_completion_date = ? THEN streak_count + 1
+            WHEN last_completion_date = excluded.last_completion_date THEN streak_count
+            ELSE 1 END,
+        last_completion_date = excluded.last_completion_date
+"""
+
+
+def _rewards(gained_xp, stats):
     return {
         "gained_xp": gained_xp,
-        "total_xp": new_xp,
-        "streak": new_streak,
-        "level": int(new_xp / 500) + 1  
+        "total_xp": stats["xp"],
+        "streak": stats["streak"],
+        "level": int(stats["xp"] / 500) + 1
     }
 
 
+def _no_stats():
+    return {"xp": 0, "streak": 0, "last_date": None}
+
+
+def _apply(stats, gained_xp, today, yesterday):
+    if stats["last_date"] == yesterday:
+        stats["streak"] += 1
+    elif stats["last_date"] != today:
+        stats["streak"] = 1
+    stats["xp"] += gained_xp
+    stats["last_date"] = today
+
+
+class RewardsLedger:
+    def __init__(self, flush_seconds=REWARDS_FLUSH_SECONDS, max_users=REWARDS_CACHE_SIZE):
+        self.batched = flush_seconds > 0
+        self.flush_seconds = flush_seconds
+        self.max_users = max_users
+        self.hot = OrderedDict()
+        self.pending = []
+        self.unflushed = {}  # user_id -> awards in `pending` or mid-flush
+        self.lock = threading.Lock()
+
+    def _keep(self, user_id, stats):
+        # caller holds the lock
+        self.hot[user_id] = stats
+        self.hot.move_to_end(user_id)
+        while len(self.hot) > self.max_users:
+            old = next((u for u in self.hot if u not in self.unflushed), None)
+            if old is None:
+                break
+            del self.hot[old]
+
+    def _load(self, user_id):
+        row = get_conn().execute("SELECT xp, streak_count, last_completion_date FROM user_stats WHERE user_id = ?",
+                                 (user_id,)).fetchone()
+        return {"xp": row[0], "streak": row[1], "last_date": row[2]} if row else None
+
+    def award(self, user_id, task_difficulty):
+        gained_xp = int(task_difficulty * 10)
+        today = datetime.now().strftime("%Y-%m-%d")
+        yesterday = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
+
+        if not self.batched and not jobs.accepting():
+            with get_conn() as conn:
+                xp, streak = conn.execute(_REWARD_UPSERT + " RETURNING xp, streak_count",
+                                          (user_id, gained_xp, today, yesterday)).fetchone()
+            stats = {"xp": xp, "streak": streak, "last_date": today}
+            with self.lock:
+                if user_id not in self.unflushed:
+                    self._keep(user_id, stats)
+            return _rewards(gained_xp, stats)
+
+        with self.lock:
+            stats = self.hot.get(user_id)
+            if stats is None:
+                stats = self._load(user_id) or _no_stats()
+            self._keep(user_id, stats)
+            _apply(stats, gained_xp, today, yesterday)
+            self.pending.append((user_id, gained_xp, today, yesterday))
+            self.unflushed[user_id] = self.unflushed.get(user_id, 0) + 1
+            rewards = _rewards(gained_xp, dict(stats))
+        if not self.batched:
+            jobs.submit(self.flush)
+        return rewards
+
+    def preview(self, user_id, task_difficulty, stats=None):
+        """What award() would return, without recording anything; pass `stats` from astats()
+        to keep the read off the event loop."""
+        gained_xp = int(task_difficulty * 10)
+        stats = dict(stats) if stats is not None else self.stats(user_id)
+        _apply(stats, gained_xp, datetime.now().strftime("%Y-%m-%d"),
+               (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d"))
+        return _rewards(gained_xp, stats)
+
+    def stats(self, user_id):
+        # write-through mode re-reads the row (a primary-key lookup) unless our own awards
+        # are still on their way to it; batched mode trusts the cache between flushes
+        with self.lock:
+            stats = self.hot.get(user_id)
+            if stats is None or not (self.batched or user_id in self.unflushed):
+                stats = self._load(user_id)
+                if stats is None:
+                    return _no_stats()  # nothing to cache for ids that never earned anything
+            self._keep(user_id, stats)
+            return dict(stats)
+
+    def warm(self, user_id):
+        """Caches a user's stats ahead of their first completion (run as a background job when
+        a task starts); users with no row yet are cached as zeros since they're about to earn."""
+        with self.lock:
+            if user_id not in self.hot:
+                self._keep(user_id, self._load(user_id) or _no_stats())
+
+    def cached(self, user_id):
+        with self.lock:
+            stats = self.hot.get(user_id)
+            return dict(stats) if stats is not None else None
+
+    async def astats(self, user_id):
+        """stats() with the read on a worker thread, for the event loop."""
+        return await asyncio.to_thread(self.stats, user_id)
+
+    def flush(self):
+        with self.lock:
+            batch, self.pending = self.pending, []
+        if not batch:
+            return 0
+        try:
+            with get_conn() as conn:
+                stored = {}
+                for row in batch:
+                    xp, streak = conn.execute(_REWARD_UPSERT + " RETURNING xp, streak_count", row).fetchone()
+                    stored[row[0]] = {"xp": xp, "streak": streak, "last_date": row[2]}
+        except Exception:
+            with self.lock:
+                self.pending[:0] = batch
+            raise
+        with self.lock:
+            for user_id, *_ in batch:
+                self.unflushed[user_id] -= 1
+                if not self.unflushed[user_id]:
+                    del self.unflushed[user_id]
+            for user_id, stats in stored.items():
+                if user_id not in self.unflushed:
+                    self._keep(user_id, stats)  # picks up what other workers added meanwhile
+        return len(batch)
+
+    async def run_flusher(self):
+        while True:
+            await asyncio.sleep(self.flush_seconds)
+            try:
+                await asyncio.to_thread(self.flush)
+            except Exception as e:
+                print(f"❌ Rewards flush failed: {e}")
+
+
+ledger = RewardsLedger()
+
+def process_rewards(user_id, task_difficulty):
+    return ledger.award(user_id, task_difficulty)
+
+
 def test_gamification_engine():
     print("🎮 INITIATING DOPAMINE REACTOR TEST 🎮")
     print("-" * 40)
@@ -111,11 +260,9 @@ def test_gamification_engine():
     print(f"[STEP 1] Completing a high-difficulty task...")
     advance_step(test_state) 
     
-    conn = sqlite3.connect('database.db')
-    cursor = conn.cursor()
+    cursor = get_conn().cursor()
     cursor.execute("SELECT xp, streak_count, last_completion_date FROM user_stats WHERE user_id = ?", (user_id,))
     xp, streak, last_date = cursor.fetchone()
-    conn.close()
     
     print(f"✅ REWARD LOGGED:")
     print(f"   - XP Earned: {xp} (Should be 10 + avg_diff * 5)")
@@ -123,25 +270,100 @@ def test_gamification_engine():
     print(f"   - Last Date: {last_date}")
     
     print("\n[STEP 2] Simulating a streak from yesterday...")
-    conn = sqlite3.connect('database.db')
     yesterday = "2026-02-04" 
-    conn.execute("UPDATE user_stats SET last_completion_date = ?, streak_count = 5", (yesterday,))
-    conn.commit()
-    conn.close()
+    with get_conn() as conn:
+        conn.execute("UPDATE user_stats SET last_completion_date = ?, streak_count = 5", (yesterday,))
     
     test_state['active_steps'] = [{"text": "Quick Task", "difficulty": 2}]
     test_state['current_step_index'] = 0
     advance_step(test_state)
     
-    conn = sqlite3.connect('database.db')
-    cursor = conn.cursor()
+    cursor = get_conn().cursor()
     cursor.execute("SELECT streak_count FROM user_stats WHERE user_id = ?", (user_id,))
     new_streak = cursor.fetchone()[0]
-    conn.close()
     
     if new_streak == 6:
         print(f"🔥 STREAK CERTIFIED: 5 + 1 = {new_streak}!")
     else:
         print(f"❌ STREAK FAILED: Expected 6, got {new_streak}")
 
-   
+
+def test_concurrent_rewards(threads=16, awards=200):
+    print("🎮 HAMMERING THE LEDGER FROM MANY THREADS 🎮")
+    init_gamification_db()
+    user_id = "concurrency_user"
+    with get_conn() as conn:
+        conn.execute("DELETE FROM user_stats WHERE user_id = ?", (user_id,))
+    ledger.hot.pop(user_id, None)
+
+    def worker():
+        for _ in range(awards):
+            process_rewards(user_id, 1)
+
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    ledger.flush()
+
+    xp = get_conn().execute("SELECT xp FROM user_stats WHERE user_id = ?", (user_id,)).fetchone()[0]
+    expected = threads * awards * 10
+    if xp == expected:
+        print(f"✅ NO LOST XP: {xp} == {expected}")
+    else:
+        print(f"❌ LOST XP: got {xp}, expected {expected}")
+
+
+def test_session_conflicts():
+    print("🎮 TWO WORKERS, ONE SESSION 🎮")
+    import time
+    from db import init_db
+    from session_store import SessionStore, SQLiteBackend, RedisBackend
+    init_db()
+    backends = [("sqlite", SQLiteBackend(), SQLiteBackend())]
+    try:
+        import fakeredis
+        client = fakeredis.FakeRedis()
+        backends.append(("fakeredis", RedisBackend(client=client), RedisBackend(client=client)))
+    except ImportError:
+        print("⚠️ fakeredis not installed, skipping the Redis backend")
+
+    checks = []
+    for name, backend_a, backend_b in backends:
+        a, b = SessionStore(backend_a, shared=True), SessionStore(backend_b, shared=True)
+        sid = f"conflict_{name}_{time.time()}"
+        a[sid] = init_state(sid)
+        a.commit(sid)
+
+        # plain CAS: both workers hold version 1, b commits first
+        a[sid]["level"] = 3
+        b[sid]["streak"] = 7
+        b_won = b.commit(sid)
+        a_won = a.commit(sid)
+        reloaded = a.get(sid)
+        checks += [(f"{name}: first committer wins", b_won is True),
+                   (f"{name}: loser gets False", a_won is False),
+                   (f"{name}: loser reloads the winner's copy", reloaded["streak"] == 7 and reloaded["level"] == 1)]
+
+        # a turn that loses mid-way is replayed, and only the replay's held effects run
+        attempts, applied = [], []
+
+        async def turn(state):
+            if not attempts:
+                b[sid]["streak"] += 1  # the other worker commits while this turn is running
+                b.commit(sid)
+            attempts.append(state["streak"])
+            after_commit(applied.append, state["streak"])
+            state["level"] = 5
+            return "done"
+
+        result = asyncio.run(a.run_turn(sid, turn))
+        final = SessionStore(backend_a, shared=True).get(sid)
+        checks += [(f"{name}: turn replayed once", result == "done" and attempts == [7, 8]),
+                   (f"{name}: losing attempt's effects discarded", applied == [8]),
+                   (f"{name}: both workers' changes stored", final["streak"] == 8 and final["level"] == 5)]
+
+    for label, ok in checks:
+        print(f"{'✅' if ok else '❌'} {label}")
+    assert all(ok for _, ok in checks)
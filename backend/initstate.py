@@ -1,5 +1,204 @@
-def init_state():
-    return {
+import os
+import sys
+import json
+import base64
+from array import array
+from collections import deque
+
+# Everything a session can hold. Keys that were never set are simply absent (the slot is
+# empty), so state.get(key, default) and `key in state` behave exactly like the old dict.
+SESSION_FIELDS = (
+    "session_id", "current_intent", "active_task_intent", "active_plan", "plan_index",
+    "active_steps", "current_step_index", "paused_task", "paused", "onboarding_complete",
+    "onboarding_step", "chat_history", "chat_summary", "chat_lines_total", "user_pfp", "total_xp",
+    "level", "streak", "focus_shields",
+    "pending_task_from_db", "routine_buffer", "convo", "last_user_text", "last_ai_message",
+    "last_energy_level", "last_action_timestamp", "idle_nudged_at", "user_confirmed_commitment",
+    "last_reward", "last_event_llm_calls", "pause_task", "active_task",
+)
+CHAT_HISTORY_MAX = int(os.getenv("CHAT_HISTORY_MAX", "40"))
+_STATE_MAGIC = b"SS\x01"
+_STEPS_TAG = "\x00steps"
+
+
+class Steps:
+    """Decomposed steps as parallel columns instead of one dict per step.
+    Indexing hands back a fresh {"text", "difficulty", "duration_minutes"} dict."""
+    __slots__ = ("texts", "difficulty", "duration")
+
+    def __init__(self, texts=(), difficulty=None, duration=None):
+        self.texts = tuple(texts)
+        self.difficulty = difficulty if difficulty is not None else array("d")
+        self.duration = duration if duration is not None else array("d")
+
+    @classmethod
+    def pack(cls, steps):
+        if isinstance(steps, Steps) or steps is None:
+            return steps
+        return cls([s["text"] for s in steps],
+                   array("d", [s.get("difficulty", 5) for s in steps]),
+                   array("d", [s.get("duration_minutes", 3) for s in steps]))
+
+    def __len__(self):
+        return len(self.texts)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return {"text": self.texts[index], "difficulty": _number(self.difficulty[index]),
+                "duration_minutes": _number(self.duration[index])}
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def __eq__(self, other):
+        return list(self) == list(other) if isinstance(other, (Steps, list, tuple)) else NotImplemented
+
+    def __repr__(self):
+        return f"Steps({list(self)!r})"
+
+
+def _number(value):
+    return int(value) if value.is_integer() else value
+
+
+class SessionState:
+    """Per-session state with one slot per known key; anything unexpected goes to `extra`.
+    Reads and writes through the mapping protocol, so arch/render/game still use state['x']."""
+    __slots__ = SESSION_FIELDS + ("extra",)
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key) if key in _SLOTS else self.extra[key]
+        except (AttributeError, TypeError):
+            raise KeyError(key) from None
+
+    def __setitem__(self, key, value):
+        if key == "active_steps":
+            value = Steps.pack(value)
+        elif key == "chat_history" and not isinstance(value, deque):
+            value = deque(value, maxlen=CHAT_HISTORY_MAX)
+        elif key == "paused_task" and isinstance(value, dict) and value.get("steps") is not None:
+            value = dict(value, steps=Steps.pack(value["steps"]))
+        if key in _SLOTS:
+            setattr(self, key, value)
+        else:
+            if getattr(self, "extra", None) is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        if key in _SLOTS:
+            delattr(self, key)
+        else:
+            del self.extra[key]
+
+    def __contains__(self, key):
+        return hasattr(self, key) if key in _SLOTS else key in (getattr(self, "extra", None) or ())
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return [k for k in SESSION_FIELDS if hasattr(self, k)] + list(getattr(self, "extra", None) or ())
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def items(self):
+        return [(k, self[k]) for k in self.keys()]
+
+    def update(self, other=(), **kwargs):
+        for key, value in dict(other, **kwargs).items():
+            self[key] = value
+
+    def to_dict(self):
+        """Plain JSON-shaped copy (steps as lists of dicts, history as a list)."""
+        return {k: _plain(v) for k, v in self.items()}
+
+    @classmethod
+    def from_dict(cls, data):
+        state = cls()
+        state.update(data)
+        return state
+
+    def to_bytes(self):
+        return _STATE_MAGIC + json.dumps(dict(self.items()), separators=(",", ":"),
+                                         ensure_ascii=False, default=_encode).encode()
+
+    @classmethod
+    def from_bytes(cls, blob):
+        return cls.from_dict(json.loads(blob[len(_STATE_MAGIC):], object_hook=_decode))
+
+
+_SLOTS = frozenset(SESSION_FIELDS)
+
+
+
+def _plain(value):
+    if isinstance(value, (Steps, deque)):
+        return [_plain(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _plain(v) for k, v in value.items()}
+    return value
+
+
+def _encode(value):
+    # compact JSON: steps become a tagged object of base64 little-endian float64 columns and
+    # anything exotic is stringified, as the old json.dumps(default=str) snapshot did
+    if isinstance(value, Steps):
+        return {_STEPS_TAG: [value.texts, _pack_column(value.difficulty), _pack_column(value.duration)]}
+    if isinstance(value, deque):
+        return list(value)
+    return str(value)
+
+
+def _decode(obj):
+    if _STEPS_TAG in obj:
+        texts, difficulty, duration = obj[_STEPS_TAG]
+        return Steps(texts, _unpack_column(difficulty), _unpack_column(duration))
+    return obj
+
+
+def _pack_column(column):
+    if sys.byteorder == "big":
+        column = array("d", column)
+        column.byteswap()
+    return base64.b64encode(column.tobytes()).decode("ascii")
+
+
+def _unpack_column(text):
+    column = array("d")
+    column.frombytes(base64.b64decode(text))
+    if sys.byteorder == "big":
+        column.byteswap()
+    return column
+
+
+def dump_state(state):
+    return state.to_bytes() if isinstance(state, SessionState) else SessionState.from_dict(state).to_bytes()
+
+
+def load_state(blob):
+    """Binary snapshots, or JSON ones written before SessionState existed."""
+    if isinstance(blob, str):
+        blob = blob.encode()
+    if blob.startswith(_STATE_MAGIC):
+        return SessionState.from_bytes(blob)
+    return SessionState.from_dict(json.loads(blob))
+
+
+def init_state(session_id=None):
+    return SessionState.from_dict({
+        "session_id": session_id,
         "current_intent": None,
         "active_task_intent": None,
         "active_plan": None,
@@ -21,7 +220,7 @@ def init_state():
         "level": 1,
         "streak": 0,
         "focus_shields": 3
-    }
+    })
 
 user_pfp = {
   "prefers_short_steps": True,
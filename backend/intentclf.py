@@ -0,0 +1,175 @@
+import os
+import re
+import json
+import math
+import zlib
+import threading
+
+# First-stage intent classifier: keyword rules, then a hashed n-gram softmax model
+# trained on seed examples plus whatever the LLM labelled in production (INTENT_LOG).
+# Plain Python on purpose: inputs are a handful of words, so sparse dict maths is
+# already microseconds and we avoid a NumPy dependency.
+# 1.0 = only the keyword rules skip the LLM. The model's softmax is not a calibrated
+# confidence (it gives 0.9+ to venting and to "help me"), so lower this only after checking
+# the numbers in `python bench.py intent`. > 1 disables the fast path.
+INTENT_FAST_THRESHOLD = float(os.getenv("INTENT_FAST_THRESHOLD", "1.0"))
+INTENT_LOG = os.getenv("INTENT_LOG")  # JSONL of LLM-labelled {"text", "intent"}; unset = don't log
+HASH_BUCKETS = 1 << 18
+
+# routine_management needs the LLM's time/action slots, so it is never answered locally
+FAST_INTENTS = ("conversation", "task_decomposition", "day_planning", "profile_update")
+
+RULES = [
+    (re.compile(r"^(ok(ay)?,? )?(lets|let's) (go|do (it|this)|start)\b|^(start|begin|go|do it)( now)?[.! ]*$"), "task_decomposition"),
+    (re.compile(r"\bplan (out )?(my|the|today|tomorrow)\b|\b(schedule|plan) for (today|tomorrow)\b|\bwhat should i do today\b"), "day_planning"),
+    (re.compile(r"\b(every|each) (day|night|morning|evening|week|monday|tuesday|wednesday|thursday|friday|saturday|sunday)\b|\bdaily\b|\bi usually\b"), "routine_management"),
+    (re.compile(r"^(hi|hey|hello|yo|thanks|thank you|thx|good (morning|night|evening))[.! ]*$"), "conversation"),
+]
+
+# the fast path can't fill time_of_the_task, so anything with a time or day in it goes to the LLM
+WHEN = re.compile(r"\b\d{1,2}(:\d{2})?\s*(am|pm)\b|\b\d{1,2}:\d{2}\b|\b(at|by|before|after) \d|\b(tomorrow|tonight|"
+                  r"next week|(on )?(monday|tuesday|wednesday|thursday|friday|saturday|sunday))\b")
+
+SEED = {
+    "task_decomposition": [
+        "help me study calculus", "break down cleaning my room", "start now", "lets go",
+        "help me clean my room", "i need to write my essay", "help me do the dishes",
+        "break down my homework", "i want to start on my taxes", "walk me through doing laundry",
+        "help me reply to my emails", "i need to pack for my trip", "let's start the report",
+        "help me get started on my project", "guide me through cooking dinner",
+        "i have to finish my presentation", "start cleaning the kitchen", "do my assignment with me",
+        "help me organize my desk", "i need to study for the exam",
+    ],
+    "day_planning": [
+        "plan my day", "what should i do today", "i have laundry, emails and gym today plan it",
+        "organize my day", "schedule my tasks for today", "i have a meeting, groceries and study to fit in",
+        "make a schedule for tomorrow", "help me plan my afternoon", "i need to do groceries, cook and call mom",
+        "plan my morning", "sort out my day for me", "today i have three assignments and a shift",
+        "can you schedule my day", "lay out my tasks for today", "i have lots to do today, plan it",
+        "plan tomorrow for me", "fit reading, laundry and exercise into today",
+    ],
+    "routine_management": [
+        "every night i journal", "i usually study late", "remind me to meditate every morning",
+        "i go to the gym every monday", "each evening i read", "i take my meds daily at 9",
+        "every day at 7 i walk the dog", "i always stretch before bed", "add a daily routine for reading",
+        "every sunday i do meal prep",
+    ],
+    "profile_update": [
+        "i'm a morning person", "i have adhd", "i prefer short steps", "i focus better at night",
+        "my energy is low in the afternoons", "i get overwhelmed by long lists", "i like voice instructions",
+        "i need more breaks", "i'm autistic", "i work best in the evening", "i lose focus easily",
+        "i prefer gentle reminders", "i'm a night owl", "long texts are hard for me to read",
+    ],
+    "conversation": [
+        "i'm tired", "why is this so hard", "can you help me?", "hi", "hello", "thanks",
+        "how are you", "i feel sad today", "i don't know what to do", "that's annoying",
+        "tell me something nice", "i'm stressed", "what can you do", "ugh", "nothing is working",
+        "i feel stuck", "who are you", "that was great", "i'm bored", "ok thanks",
+    ],
+}
+LABELS = tuple(SEED)
+
+
+def _tokens(text):
+    return re.findall(r"[a-z0-9]+", text.lower().replace("'", ""))
+
+
+def _features(text):
+    words = _tokens(text)
+    feats = [f"w:{w}" for w in words]
+    feats += [f"b:{a}_{b}" for a, b in zip(words, words[1:])]
+    for w in words:
+        padded = f"<{w}>"
+        feats += [f"c:{padded[i:i + 3]}" for i in range(len(padded) - 2)]
+    feats.append("bias")
+    return [zlib.crc32(f.encode()) % HASH_BUCKETS for f in feats]
+
+
+class IntentClassifier:
+    def __init__(self, threshold=INTENT_FAST_THRESHOLD, log_path=INTENT_LOG):
+        self.threshold = threshold
+        self.log_path = log_path
+        self.weights = None
+        self.lock = threading.Lock()
+        self.fast = 0
+        self.fallback = 0
+
+    def examples(self):
+        data = [(text, label) for label, texts in SEED.items() for text in texts]
+        if self.log_path and os.path.exists(self.log_path):
+            with open(self.log_path) as f:
+                for line in f:
+                    row = json.loads(line)
+                    if row.get("intent") in LABELS:
+                        data.append((row["text"], row["intent"]))
+        return data
+
+    def train(self, examples=None, epochs=40, lr=0.5):
+        # multinomial logistic regression, plain SGD over sparse hashed features
+        examples = self.examples() if examples is None else examples
+        weights = {label: {} for label in LABELS}
+        encoded = [(_features(text), label) for text, label in examples]
+        for epoch in range(epochs):
+            step = lr / (1 + epoch * 0.1)
+            for feats, label in encoded:
+                probs = self._softmax(weights, feats)
+                for cls, p in probs.items():
+                    grad = (1.0 if cls == label else 0.0) - p
+                    w = weights[cls]
+                    for h in feats:
+                        w[h] = w.get(h, 0.0) + step * grad
+        self.weights = weights
+        return self
+
+    @staticmethod
+    def _softmax(weights, feats):
+        scores = {cls: sum(w.get(h, 0.0) for h in feats) for cls, w in weights.items()}
+        top = max(scores.values())
+        exp = {cls: math.exp(s - top) for cls, s in scores.items()}
+        total = sum(exp.values())
+        return {cls: e / total for cls, e in exp.items()}
+
+    def classify(self, text):
+        """(intent, confidence); keyword rules answer with confidence 1.0, the model always below it."""
+        lowered = text.lower().strip()
+        for pattern, intent in RULES:
+            if pattern.search(lowered):
+                return intent, 1.0
+        if self.weights is None:
+            with self.lock:
+                if self.weights is None:
+                    self.train()
+        probs = self._softmax(self.weights, _features(text))
+        intent = max(probs, key=probs.get)
+        return intent, min(probs[intent], 0.999)
+
+    def fast_slots(self, text):
+        """IntentSlots-shaped dict when we are confident enough to skip the LLM, else None."""
+        intent, confidence = self.classify(text)
+        timed = intent != "day_planning" and WHEN.search(text.lower())
+        if intent not in FAST_INTENTS or confidence < self.threshold or timed:
+            self.fallback += 1
+            return None
+        self.fast += 1
+        return {"intent": intent, "action": text if intent == "task_decomposition" else None,
+                "temporal_reference": "none", "time_of_the_task": None, "is_routine": False}
+
+    def record(self, text, intent):
+        """Keep what the LLM decided as training data for the next train()."""
+        if self.log_path and intent in LABELS:
+            with self.lock, open(self.log_path, "a") as f:
+                f.write(json.dumps({"text": text, "intent": intent}) + "\n")
+
+    def stats(self):
+        total = self.fast + self.fallback
+        return {"fast": self.fast, "fallback": self.fallback, "threshold": self.threshold,
+                "fast_rate": round(self.fast / total, 3) if total else 0.0}
+
+
+_classifier = None
+
+def get_classifier():
+    global _classifier
+    if _classifier is None:
+        _classifier = IntentClassifier()
+    return _classifier
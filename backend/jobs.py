@@ -0,0 +1,176 @@
+import os
+import asyncio
+import contextvars
+
+# Disk writes that a response doesn't need to wait for (profile saves, status changes,
+# activity/history logging, reward flushes) go through this queue once the app is running.
+# One worker by default: SQLite takes one writer at a time anyway, and a single worker keeps
+# jobs in submission order. When the queue is full the caller runs the job itself, so a
+# backlog slows producers down instead of growing without bound. JOBS_WORKERS=0 turns the
+# queue off and every write runs inline, as before.
+JOBS_QUEUE_SIZE = int(os.getenv("JOBS_QUEUE_SIZE", "1000"))
+JOBS_WORKERS = int(os.getenv("JOBS_WORKERS", "1"))
+JOBS_RETRIES = int(os.getenv("JOBS_RETRIES", "3"))
+JOBS_RETRY_DELAY = float(os.getenv("JOBS_RETRY_DELAY", "0.2"))
+JOBS_DRAIN_SECONDS = float(os.getenv("JOBS_DRAIN_SECONDS", "10"))
+JOBS_BATCH = 64
+
+
+class JobRunner:
+    def __init__(self, max_size=JOBS_QUEUE_SIZE, workers=JOBS_WORKERS, retries=JOBS_RETRIES,
+                 retry_delay=JOBS_RETRY_DELAY):
+        self.max_size = max_size
+        self.worker_count = workers
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.loop = None
+        self.queue = None
+        self.workers = []
+        self.queued = 0
+        self.inline = 0
+        self.backpressure = 0
+        self.done = 0
+        self.retried = 0
+        self.failed = 0
+        self.max_depth = 0
+
+    def start(self):
+        if self.worker_count <= 0:
+            return
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(self.max_size)
+        self.workers = [self.loop.create_task(self._worker()) for _ in range(self.worker_count)]
+
+    def accepting(self):
+        """True when called on the serving loop while it is up; scripts and sync paths run inline."""
+        try:
+            return self.loop is not None and asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            return False
+
+    def submit(self, fn, *args):
+        """Queues fn(*args) for a worker thread; returns False if it had to run right here instead."""
+        if self.accepting():
+            try:
+                self.queue.put_nowait((fn, args))
+                self.queued += 1
+                self.max_depth = max(self.max_depth, self.queue.qsize())
+                return True
+            except asyncio.QueueFull:
+                self.backpressure += 1
+        else:
+            self.inline += 1
+        fn(*args)
+        return False
+
+    async def _worker(self):
+        while True:
+            batch = [await self.queue.get()]
+            # whatever piled up meanwhile rides the same thread hop
+            while len(batch) < JOBS_BATCH and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            try:
+                for fn, args, error in await asyncio.to_thread(self._run_batch, batch):
+                    await self._retry(fn, args, error)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def _run_batch(self, batch):
+        failures = []
+        for fn, args in batch:
+            try:
+                fn(*args)
+                self.done += 1
+            except Exception as e:
+                failures.append((fn, args, e))
+        return failures
+
+    async def _retry(self, fn, args, error):
+        for attempt in range(self.retries):
+            self.retried += 1
+            await asyncio.sleep(self.retry_delay * 2 ** attempt)
+            try:
+                await asyncio.to_thread(fn, *args)
+                self.done += 1
+                return
+            except Exception as e:
+                error = e
+        self.failed += 1
+        print(f"❌ Background job {fn.__name__} failed after {self.retries + 1} attempts: {error}")
+
+    async def drain(self, timeout=JOBS_DRAIN_SECONDS):
+        """Stops taking new jobs (later submits run inline) and waits for the queue to empty."""
+        if self.queue is None:
+            return
+        self.loop = None
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            print(f"⚠️ Shutdown left {self.queue.qsize()} background job(s) undone")
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+        self.queue = None
+
+    def submit_after_commit(self, fn, *args):
+        """submit(), but from inside a session turn only once that turn's commit has won."""
+        after_commit(self.submit, fn, *args)
+
+    def stats(self):
+        return {
+            "running": self.queue is not None,
+            "depth": self.queue.qsize() if self.queue is not None else 0,
+            "max_depth": self.max_depth,
+            "queued": self.queued,
+            "inline": self.inline,
+            "backpressure": self.backpressure,
+            "done": self.done,
+            "retried": self.retried,
+            "failed": self.failed,
+        }
+
+
+jobs = JobRunner()
+
+
+# Side effects of a session turn (XP, activity and history rows, task status and schedule
+# writes) are held while the turn runs and released only once its session commit wins. A turn
+# that loses the race is replayed on the fresh state, and its first run must leave no trace.
+_held = contextvars.ContextVar("held_effects", default=None)
+
+
+class HeldEffects:
+    def __init__(self):
+        self.items = []
+        self.token = None
+
+    def __enter__(self):
+        self.token = _held.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _held.reset(self.token)
+        if exc_type is not None:
+            # a turn that blew up mid-way still leaves its partial state live, as before
+            self.release()
+        return False
+
+    def release(self):
+        items, self.items = self.items, []
+        for fn, args in items:
+            fn(*args)
+
+    def discard(self):
+        dropped, self.items = len(self.items), []
+        return dropped
+
+
+def after_commit(fn, *args):
+    """Runs fn(*args) now, or at the end of the enclosing turn if its commit wins."""
+    held = _held.get()
+    if held is None:
+        fn(*args)
+    else:
+        held.items.append((fn, args))
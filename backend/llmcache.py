@@ -0,0 +1,146 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+# temperature=0 completions are deterministic, so identical prompts can share an answer
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "2048"))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(24 * 3600)))
+LLM_CACHE_DB = os.getenv("LLM_CACHE_DB")  # unset = memory-only
+
+
+def cache_key(model_name, system_prompt, user_prompt):
+    """Digest of the prompt triple as sent (callers mask PII first); prompt text is never stored."""
+    h = hashlib.sha256()
+    for part in (model_name, system_prompt, user_prompt):
+        h.update(part.encode())
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+class MemoryTier:
+    def __init__(self, max_size=LLM_CACHE_SIZE, ttl=LLM_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                self.evictions += 1
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class SQLiteTier:
+    """Persistent tier; responses are Fernet-encrypted like every other row we store."""
+
+    def __init__(self, path=LLM_CACHE_DB, ttl=LLM_CACHE_TTL):
+        from db import get_cipher
+        self.cipher = get_cipher()
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, response BLOB, expires REAL)')
+        self.conn.commit()
+
+    def get(self, key):
+        with self.lock:
+            row = self.conn.execute("SELECT response, expires FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] < time.time():
+                self.conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self.conn.commit()
+                return None
+        return self.cipher.decrypt(row[0]).decode()
+
+    def set(self, key, value):
+        blob = self.cipher.encrypt(value.encode())
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO llm_cache (key, response, expires) VALUES (?, ?, ?)",
+                              (key, blob, time.time() + self.ttl))
+            self.conn.commit()
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM llm_cache")
+            self.conn.commit()
+
+
+class ResponseCache:
+    def __init__(self, memory=None, persistent=None):
+        self.memory = memory if memory is not None else MemoryTier()
+        self.persistent = persistent
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is None and self.persistent is not None:
+            value = self.persistent.get(key)
+            if value is not None:
+                self.disk_hits += 1
+                self.memory.set(key, value)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self.memory.set(key, value)
+        if self.persistent is not None:
+            self.persistent.set(key, value)
+
+    def clear(self):
+        self.memory.clear()
+        if self.persistent is not None:
+            self.persistent.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "size": len(self.memory),
+            "evictions": self.memory.evictions,
+        }
+
+
+_default_cache = None
+
+def default_cache():
+    global _default_cache
+    if _default_cache is None:
+        persistent = SQLiteTier() if LLM_CACHE_DB else None
+        _default_cache = ResponseCache(persistent=persistent)
+    return _default_cache
@@ -0,0 +1,223 @@
+import re
+import ast
+import json
+from typing import List, Literal, Optional, Union
+from pydantic import BaseModel, ConfigDict, Field, ValidationError, field_validator
+
+
+class ObjectScanner:
+    """
+    Pulls complete JSON objects out of a document as it streams in. Objects nested
+    at `depth` (counting braces only) are parsed the moment their closing brace
+    arrives, e.g. depth=2 yields each {"text": ...} inside {"steps": [...]}.
+    """
+
+    def __init__(self, depth=2):
+        self.target = depth
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.buf = []
+
+    def feed(self, text):
+        found = []
+        for ch in text:
+            if self.depth >= self.target:
+                self.buf.append(ch)
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif ch == "\\":
+                    self.escaped = True
+                elif ch == '"':
+                    self.in_string = False
+                continue
+            if ch == '"':
+                self.in_string = True
+            elif ch == "{":
+                self.depth += 1
+                if self.depth == self.target:
+                    self.buf = ["{"]
+            elif ch == "}" and self.depth > 0:
+                if self.depth == self.target:
+                    try:
+                        found.append(json.loads("".join(self.buf)))
+                    except ValueError:
+                        pass
+                    self.buf = []
+                self.depth -= 1
+        return found
+
+
+class LLMOutputError(ValueError):
+    """Model output could not be turned into the expected JSON, even after a repair pass."""
+
+
+INTENTS = ("conversation", "task_decomposition", "day_planning", "routine_management", "profile_update")
+
+
+class IntentSlots(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    intent: Literal[INTENTS] = "conversation"
+    action: Optional[str] = None
+    temporal_reference: Optional[str] = None
+    time_of_the_task: Optional[str] = None
+    is_routine: bool = False
+
+    @field_validator("intent", mode="before")
+    @classmethod
+    def _unknown_intent_is_conversation(cls, v):
+        # the prompt's own rule: "If unsure, choose conversation"
+        return v if v in INTENTS else "conversation"
+
+    @field_validator("action", "temporal_reference", "time_of_the_task", mode="before")
+    @classmethod
+    def _as_text(cls, v):
+        return None if v is None else str(v)
+
+
+class Step(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    text: str
+    difficulty: Union[int, float] = 5
+    duration_minutes: Union[int, float] = 3
+
+
+class StepList(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    steps: List[Step] = Field(min_length=1)
+    overall_difficulty: Optional[Union[int, float]] = None
+
+
+class PlanItem(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    activity: str
+    difficulty: Union[int, float] = 3
+    start_time: str
+
+
+class DayPlan(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    plan: List[PlanItem]
+
+
+SCHEMA_HINTS = {
+    IntentSlots: '{"intent": one of ' + "|".join(INTENTS) + ', "action": string, "temporal_reference": string, '
+                 '"time_of_the_task": string, "is_routine": boolean}',
+    StepList: '{"steps": [{"text": string, "difficulty": number, "duration_minutes": number}], "overall_difficulty": number}',
+    DayPlan: '{"plan": [{"activity": string, "difficulty": number, "start_time": "YYYY-MM-DD HH:MM"}]}',
+}
+
+# per schema: clean parses, locally repaired, fixed by re-generation, given up on
+parse_stats = {}
+
+_FENCE = re.compile(r"```(?:json)?", re.IGNORECASE)
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+_SMART_QUOTES = str.maketrans({"\u201c": '"', "\u201d": '"', "\u2018": "'", "\u2019": "'"})
+
+
+def _outer_object(text):
+    """First top-level {...} in text; if the model stopped early, close what is still open."""
+    start = text.find("{")
+    if start < 0:
+        return None
+    closers = []
+    in_string = escaped = False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            closers.append("}" if ch == "{" else "]")
+        elif ch in "}]" and closers:
+            closers.pop()
+            if not closers:
+                return text[start:i + 1]
+    return text[start:] + ('"' if in_string else "") + "".join(reversed(closers))
+
+
+def extract_json(text):
+    """
+    Returns (object, repaired). Handles prose around the JSON, markdown fences,
+    trailing commas, smart quotes, truncated output and Python-style dict reprs.
+    """
+    try:
+        return json.loads(text), False
+    except (TypeError, ValueError):
+        pass
+    if not isinstance(text, str):
+        raise LLMOutputError("no text to parse")
+    candidate = _outer_object(_FENCE.sub("", text).translate(_SMART_QUOTES))
+    if candidate is None:
+        raise LLMOutputError("no JSON object in model output")
+    for attempt in (candidate, _TRAILING_COMMA.sub(r"\1", candidate)):
+        try:
+            return json.loads(attempt), True
+        except ValueError:
+            pass
+    try:
+        value = ast.literal_eval(candidate)
+        if isinstance(value, dict):
+            return value, True
+    except (ValueError, SyntaxError):
+        pass
+    raise LLMOutputError("model output is not valid JSON")
+
+
+def _count(schema, outcome):
+    counts = parse_stats.setdefault(schema.__name__, {"clean": 0, "repaired": 0, "regenerated": 0, "failed": 0})
+    counts[outcome] += 1
+
+
+def parse_llm_json(text, schema):
+    """Extract and validate without touching the model; raises LLMOutputError."""
+    try:
+        value, repaired = extract_json(text)
+        result = schema.model_validate(value).model_dump()
+    except ValidationError as e:
+        raise LLMOutputError(str(e)) from e
+    return result, repaired
+
+
+async def aparse_llm_json(text, schema, model):
+    """
+    Validated dict for `schema`. Only if local extraction/repair fails do we spend
+    one extra round-trip asking the model to fix its own output.
+    """
+    try:
+        result, repaired = parse_llm_json(text, schema)
+        _count(schema, "repaired" if repaired else "clean")
+        return result
+    except LLMOutputError as e:
+        error = e
+
+    fix_prompt = ("You repair malformed JSON. Return ONLY the corrected JSON object, no prose, no markdown.\n"
+                  f"Required shape: {SCHEMA_HINTS[schema]}")
+    fixed = await model.agenerate(fix_prompt, f"Problem: {error}\n\nBroken output:\n{text}")
+    try:
+        result, _ = parse_llm_json(fixed, schema)
+    except LLMOutputError:
+        _count(schema, "failed")
+        raise
+    _count(schema, "regenerated")
+    return result
+
+
+def parse_failure_rates():
+    rates = {}
+    for name, counts in parse_stats.items():
+        total = sum(counts.values())
+        rates[name] = dict(counts, failure_rate=round(counts["failed"] / total, 3) if total else 0.0)
+    return rates
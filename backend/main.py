@@ -1,14 +1,30 @@
 
+import os
+import json
+import time
+import asyncio
 from typing import Optional, Dict, Any, List
 from fastapi import FastAPI, HTTPException, Body, UploadFile, File
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from arch import handle_event
-from LLMs import Demon,base_user_prompt
-from avision import photo_bytes_to_claim
+from arch import ahandle_event, speculation_rates
+from LLMs import Demon,base_user_prompt,stream_sink,get_model,awarm_up
+from avision import photo_bytes_to_claim, read_upload, UploadTooLarge, UploadLimit
+from visioncache import ClaimCache, dhash
 from initstate import init_state
 from db import get_profile,save_profile
+from push import session_stream, idle_nudge, poke
+from session_store import SessionStore, SessionConflict
+from llmjson import parse_failure_rates
+from prompts import prompt_token_stats
+from chatmemory import chat_memory_stats
+from intentclf import get_classifier
+from activity import activity_stats, leaderboard
+from game import ledger
+from jobs import jobs
 from contextlib import asynccontextmanager
+from starlette.concurrency import run_in_threadpool
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -19,10 +35,21 @@ async def lifespan(app: FastAPI):
     init_db()               # Creates profiles, tasks, etc.
     init_gamification_db()  # Creates the user_stats table
     print("✅ All Systems Nominal: Databases Initialized.")
+    jobs.start()
+    flusher = asyncio.create_task(sessions.run_flusher())
+    rewards_flusher = asyncio.create_task(ledger.run_flusher()) if ledger.batched else None
+    if os.getenv("LLM_WARMUP") == "1":
+        asyncio.create_task(awarm_up())
     yield
+    flusher.cancel()
+    if rewards_flusher:
+        rewards_flusher.cancel()
+    await jobs.drain()
+    sessions.flush()
+    ledger.flush()
+    await Demon.aclose()
 
 app = FastAPI(title="The Smart Companion", lifespan=lifespan)
-model = Demon()
 
 app.add_middleware(
     CORSMiddleware,
@@ -31,6 +58,7 @@ app.add_middleware(
     allow_headers=["*"],
     allow_credentials=True,
 )
+app.add_middleware(UploadLimit)
 
 class AgentEvent(BaseModel):
     session_id: str  
@@ -42,7 +70,8 @@ class OnboardingUpdate(BaseModel):
     session_id: str
     responses: Dict[str, bool] 
 
-sessions: Dict[str, Any] = {}
+sessions = SessionStore()
+vision_cache = ClaimCache()
 
 DEFAULT_PFP = {
   "prefers_short_steps": True,
@@ -62,32 +91,43 @@ DEFAULT_PFP = {
 
 @app.api_route("/", methods=["GET", "HEAD"])
 async def health_check():
-    return {"status": "The Smart Companion", "active_sessions": len(sessions)}
+    return {"status": "The Smart Companion", "active_sessions": len(sessions),
+            "sessions": sessions.stats(),
+            "llm_parse": parse_failure_rates(),
+            "llm_prompt_tokens": prompt_token_stats(),
+            "intent_fast_path": get_classifier().stats(),
+            "speculative_decompose": speculation_rates(),
+            "vision_cache": vision_cache.stats(),
+            "chat_memory": chat_memory_stats(),
+            "background_jobs": jobs.stats(),
+            "llm_cache": get_model().cache.stats() if get_model().cache else None}
 
 @app.post("/event")
 async def handle_agent_event(event: AgentEvent):
+    return {"data": await _process_event(event)}
+
+def _fresh_state(session_id):
+    new_state = init_state(session_id)
+    
+    saved_pfp = get_profile(session_id)
+    
+    if saved_pfp:
+        print(f"🧬 Restoring profile for {session_id}")
+        new_state['user_pfp'].update(saved_pfp)
+    return new_state
+
+async def _process_event(event: AgentEvent):
     if not event.session_id:
-        return {"data": {"type": "idle", "text": ""}}
-        
-    if event.session_id not in sessions:
-        new_state = init_state()
+        return {"type": "idle", "text": ""}
         
-        saved_pfp = get_profile(event.session_id)
-        
-        if saved_pfp:
-            print(f"🧬 Restoring profile for {event.session_id}")
-            new_state['user_pfp'].update(saved_pfp)
-        
-        sessions[event.session_id] = new_state
-
-    state = sessions[event.session_id]
+    async def turn(state):
+        state['last_energy_level'] = event.energy_level
 
-    try:
-        ui_response = handle_event(
+        ui_response = await ahandle_event(
             event={"type": event.event_type, "payload": event.payload},
             state=state,
             el=event.energy_level,
-            model=model,
+            model=get_model(),
             base_user_prompt=base_user_prompt
         )
 
@@ -100,12 +140,43 @@ async def handle_agent_event(event: AgentEvent):
         ui_response["xp_total"] = state.get("total_xp", 0)
         ui_response["level"] = state.get("level", 1)
         ui_response["streak"] = state.get("streak", 0)
+        return ui_response
 
-        return {"data": ui_response}
+    try:
+        ui_response = await sessions.run_turn(event.session_id, turn, fresh=_fresh_state)
+        poke(event.session_id)
+        return ui_response
 
     except Exception as e:
         print(f"❌ Backend Error: {e}")
-        return {"data": {"type": "chat", "text": "Smart Companion link unstable..."}}
+        return {"type": "chat", "text": "Smart Companion link unstable..."}
+
+@app.post("/event/stream")
+async def handle_agent_event_stream(event: AgentEvent):
+    """
+    Same turn as /event, but as SSE: chat text arrives as `token` frames and decomposed
+    steps as `step_ready` frames while the model is still writing; the usual UI payload
+    follows in a final `done` frame together with the measured time-to-first-byte.
+    """
+    started = time.perf_counter()
+    sink = asyncio.Queue()
+    token = stream_sink.set(sink)
+    turn = asyncio.create_task(_process_event(event))
+    stream_sink.reset(token)
+    turn.add_done_callback(lambda _: sink.put_nowait(None))
+
+    async def frames():
+        ttfb_ms = None
+        while (item := await sink.get()) is not None:
+            if ttfb_ms is None:
+                ttfb_ms = round((time.perf_counter() - started) * 1000, 1)
+            yield f"data: {json.dumps(item)}\n\n"
+        total_ms = round((time.perf_counter() - started) * 1000, 1)
+        print(f"⏱️ stream {event.session_id}: first byte {ttfb_ms} ms, total {total_ms} ms")
+        yield f"data: {json.dumps({'type': 'done', 'data': turn.result(), 'ttfb_ms': ttfb_ms or total_ms, 'total_ms': total_ms})}\n\n"
+
+    return StreamingResponse(frames(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @app.get("/onboarding/next-question")
 async def get_onboarding_question(step: int = 0):
@@ -133,30 +204,36 @@ async def vision_analysis(session_id: str, file: UploadFile = File(...)):
     """
     Receives image, calls teammate's logic, and updates the ADHD State Machine.
     """
-    if session_id not in sessions:
-        sessions[session_id] = init_state()
-    
     try:
-        contents = await file.read()
-        
-        vision_claim = photo_bytes_to_claim(contents) 
+        contents = await read_upload(file)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+    try:
+        image_hash = await run_in_threadpool(dhash, contents)
+        vision_claim = vision_cache.lookup(session_id, image_hash)
+        if vision_claim is None:
+            vision_claim = await run_in_threadpool(photo_bytes_to_claim, contents)
+            vision_cache.store(session_id, image_hash, vision_claim)
         
-        ui_response = handle_event(
+        ui_response = await sessions.run_turn(session_id, lambda state: ahandle_event(
             event={
                 "type": "USER_INPUT", 
                 "payload": f"[VISUAL_CONTEXT_SYNC]: {vision_claim}"
             },
-            state=sessions[session_id],
+            state=state,
             el=10, 
-            model=model,
+            model=get_model(),
             base_user_prompt=base_user_prompt
-        )
+        ), fresh=_fresh_state)
         
         return {
             "status": "vision_synced",
             "claim": vision_claim,
             "data": ui_response
         }
+    except SessionConflict:
+        raise HTTPException(status_code=409, detail="Session changed concurrently, try again")
     except Exception as e:
         print(f"Vision Integration Error: {e}")
         raise HTTPException(status_code=500, detail="Vision pipeline failed")
@@ -166,36 +243,38 @@ class OnboardingUpdate(BaseModel):
 
 @app.post("/onboarding/calibrate")
 async def calibrate_profile(update: OnboardingUpdate):
-    if update.session_id not in sessions:
-        sessions[update.session_id] = init_state()
-    
-    state = sessions[update.session_id]
-    
-    state['user_pfp'].update(update.responses)
-            
+    async def turn(state):
+        state['user_pfp'].update(update.responses)
+        jobs.submit_after_commit(save_profile, update.session_id, dict(state['user_pfp']))
+        return dict(state['user_pfp'])
+
     try:
-        save_profile(update.session_id, state['user_pfp'])
+        new_pfp = await sessions.run_turn(update.session_id, turn, fresh=_fresh_state)
+    except SessionConflict:
+        raise HTTPException(status_code=409, detail="Session changed concurrently, try again")
     except Exception as e:
+        # the profile write runs after the commit, so the session already has the answers
         print(f"❌ DB Sync Failed: {e}")
+        new_pfp = dict(sessions[update.session_id]['user_pfp'])
             
-    return {"message": "Success", "new_pfp": state['user_pfp']}
+    return {"message": "Success", "new_pfp": new_pfp}
 
 @app.post("/vision")
 async def vision_pipeline(session_id: str, file: UploadFile = File(...)):
     """The friend's hook for image analysis."""
-    if session_id not in sessions:
-        sessions[session_id] = init_state()
-    
     vision_description = "A messy kitchen with dirty dishes." 
 
-    ui_response = handle_event(
-        event={"type": "USER_INPUT", "payload": f"I see: {vision_description}"},
-        state=sessions[session_id],
-        el=10,
-        model=model,
-        base_user_prompt=base_user_prompt
+    try:
+        ui_response = await sessions.run_turn(session_id, lambda state: ahandle_event(
+            event={"type": "USER_INPUT", "payload": f"I see: {vision_description}"},
+            state=state,
+            el=10,
+            model=get_model(),
+            base_user_prompt=base_user_prompt
 
-    )
+        ), fresh=_fresh_state)
+    except SessionConflict:
+        raise HTTPException(status_code=409, detail="Session changed concurrently, try again")
     
     return {"vision_result": vision_description, "agent_response": ui_response}
 
@@ -207,21 +286,48 @@ async def reset_session(session_id: str):
     return {"message": f"Session {session_id} wiped."}
 
 
+@app.get("/stats/{session_id}")
+async def user_stats(session_id: str):
+    """XP, streak and today/week/all-time activity; rollup reads only, whatever the log size."""
+    stats = await ledger.astats(session_id)
+    return {"xp": stats["xp"], "streak": stats["streak"], "level": int(stats["xp"] / 500) + 1,
+            "activity": activity_stats(session_id)}
+
+@app.get("/leaderboard")
+async def get_leaderboard(by: str = "xp", limit: int = 10):
+    if by not in ("xp", "streak"):
+        raise HTTPException(status_code=400, detail="by must be 'xp' or 'streak'")
+    return {"by": by, "leaders": leaderboard(by, min(max(limit, 1), 100))}
+
+
 @app.get("/heartbeat/{session_id}")
 async def heartbeat(session_id: str):
-    if session_id not in sessions: return {"type": "idle"}
-    state = sessions[session_id]
-    
-    if state.get('active_steps') and state.get('last_action_timestamp'):
-        import time
-        idle_time = time.time() - state['last_action_timestamp']
-        if idle_time > 300: # 5 minutes of silence
-            return {
-                "type": "nudge",
-                "text": "Still working on that step, or are we stuck?",
-                "options": ["Still on it", "Help!", "Skip"]
-            }
-    return {"type": "idle"}
+    state = sessions.get(session_id)  # a poll, not activity: don't keep the session alive
+    if state is None: return {"type": "idle"}
+    return idle_nudge(state) or {"type": "idle"}
+
+
+async def _scheduler_pass(state):
+    try:
+        return await sessions.run_turn(state['session_id'], lambda fresh: ahandle_event(
+            event={"type": "USER_INPUT", "payload": "HEARTBEAT"},
+            state=fresh,
+            el=fresh.get('last_energy_level', 10),
+            model=get_model(),
+            base_user_prompt=base_user_prompt
+        ), fresh=None)
+    except SessionConflict as e:
+        print(f"⚠️ Scheduler pass gave up: {e!r}")
+        return None
+
+@app.get("/stream/{session_id}")
+async def stream(session_id: str):
+    """SSE channel: pushes nudges, commitment checks and routine notices as their timers fire."""
+    return StreamingResponse(
+        session_stream(session_id, sessions, _scheduler_pass),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,118 @@
+import re
+
+# One precompiled scan finds every candidate (emails, and runs of digits with phone-ish
+# punctuation); each candidate is then classified in plain Python. The lookbehinds only let
+# a candidate start at a token boundary and a digit run is consumed whole, so no position is
+# rescanned more than a bounded number of times: masking stays linear even on adversarial
+# brain-dumps (the old four re.sub passes went quadratic on long words and digit strings).
+# A "#" in front makes a number a reference (order #12345678), not a candidate.
+_CANDIDATE = re.compile(r"""
+    (?P<email>(?<![\w.+-])[\w.+-]+@[\w-]+(?:\.[\w-]+)+)
+  | (?P<num>(?<![\w#])\+?\(?\d[\d().\-\ \t]*)
+""", re.VERBOSE)
+
+_IP = re.compile(r"\d{1,3}(?:\.\d{1,3}){3}")
+_ID = re.compile(r"\d{3}-\d{2}-\d{4}")
+_DATE = re.compile(r"\d{4}-\d{2}-\d{2}")  # ISO dates are scheduling info, not phone numbers
+_BLANKS = re.compile(r"([ \t]+)")
+PHONE_MIN_DIGITS = 7
+PHONE_MAX_DIGITS = 15
+CARD_MIN_DIGITS = 13
+CARD_MAX_DIGITS = 19
+
+
+def _mask_numbers(run):
+    """Labels the IPs, ID numbers, card and phone numbers inside one run of digits and separators."""
+    out = []
+    span = []  # tokens (with the blanks between them) that may together be one phone or card number
+    digits = 0
+
+    def close():
+        nonlocal span, digits
+        trailing = []
+        while span and (span[-1].isspace() or not span[-1]):
+            trailing.append(span.pop())
+        if span:
+            out.append(_label(span[0], digits) or "".join(span))
+        out.extend(reversed(trailing))
+        span, digits = [], 0
+
+    for i, piece in enumerate(_BLANKS.split(run)):
+        if i % 2:
+            (span if span else out).append(piece)
+            continue
+        core = piece.rstrip(".-(")
+        tail = piece[len(core):]
+        if _IP.fullmatch(core) or _ID.fullmatch(core) or _DATE.fullmatch(core):
+            close()
+            out.append("[IP_ADDR]" if _IP.fullmatch(core) else "[ID_NUM]" if _ID.fullmatch(core) else core)
+        elif core:
+            count = sum(ch.isdigit() for ch in core)
+            if digits + count > CARD_MAX_DIGITS:
+                close()
+            span.append(core)
+            digits += count
+        if tail:
+            close()
+            out.append(tail)
+    close()
+    return "".join(out)
+
+
+def _label(first, digits):
+    # a leading + or ( only ever starts a phone number; otherwise 13-19 digits is a card
+    if CARD_MIN_DIGITS <= digits <= CARD_MAX_DIGITS and first[0] not in "+(":
+        return "[CARD]"
+    if PHONE_MIN_DIGITS <= digits <= PHONE_MAX_DIGITS:
+        return "[PHONE]"
+    return None
+
+
+def _replace(match):
+    return "[EMAIL]" if match.lastgroup == "email" else _mask_numbers(match.group())
+
+
+def surgical_pii_masker(text):
+    if not isinstance(text, str):
+        return text
+    return _CANDIDATE.sub(_replace, text)
+
+
+# A candidate can't cross a character outside every candidate class, nor a blank that
+# follows a letter (emails have no blanks, digit runs have no letters), so text up to
+# such a point can be masked and released while the rest waits for more input. "#" is
+# never a cut point: the number after it would lose the lookbehind that keeps it unmasked.
+_SAFE_CUT = re.compile(r"[^\w\s.+\-()@#]|[^\W\d][ \t\r\n]|\n")
+
+
+class PIIStream:
+    """Masks text that arrives in pieces (long pastes, streamed bodies) with bounded buffering."""
+
+    def __init__(self, max_hold=64 * 1024):
+        self.max_hold = max_hold
+        self.pending = ""
+
+    def feed(self, chunk):
+        self.pending += chunk
+        cut = 0
+        for match in _SAFE_CUT.finditer(self.pending, max(0, len(self.pending) - len(chunk) - 1)):
+            cut = match.end()
+        if not cut and len(self.pending) > self.max_hold:
+            cut = len(self.pending)  # pathological input with no boundary at all; give up holding
+        ready, self.pending = self.pending[:cut], self.pending[cut:]
+        return surgical_pii_masker(ready)
+
+    def close(self):
+        ready, self.pending = self.pending, ""
+        return surgical_pii_masker(ready)
+
+
+def mask_stream(chunks):
+    stream = PIIStream()
+    for chunk in chunks:
+        masked = stream.feed(chunk)
+        if masked:
+            yield masked
+    tail = stream.close()
+    if tail:
+        yield tail
@@ -0,0 +1,118 @@
+import os
+import json
+
+# Every call is (system, user). The system half only depends on the call type and the
+# profile, so it is byte-identical between requests and provider-side prefix caching can
+# reuse it; anything that changes per request (time, history, the request) goes in `user`.
+
+_TRAITS = {
+    "prefers_short_steps": "short steps",
+    "needs_breaks": "needs breaks",
+    "time_blindness": "time-blind",
+    "reading_difficulty": "plain words",
+    "easily_overwhelmed": "easily overwhelmed",
+    "difficulty_starting_tasks": "hard to start",
+    "loses_focus_easily": "loses focus",
+    "prefers_voice": "voice-first",
+    "needs_encouragement": "needs encouragement",
+    "sensitive_to_pressure": "no pressure",
+    "anxiety_with_tasks": "task anxiety",
+}
+
+PERSONA = ("You are SOUL KING, a calm, structured companion for neurodivergent users (ADHD, autism). "
+           "Turn brain dumps into tiny steps with time estimates; if energy < 3, suggest rest.")
+
+DECOMPOSE_RULES = """Break the task into gentle steps, each under 3 minutes, in simple language.
+Return ONLY JSON: {"steps": [{"text": str, "difficulty": 0-9, "duration_minutes": number}], "overall_difficulty": 0-9}"""
+
+PLAN_RULES = """Plan the day around the user's bio-rhythm. Return ONLY JSON, no other text:
+{"plan": [{"activity": str, "difficulty": 0-9, "start_time": "YYYY-MM-DD HH:MM"}]}
+- Fold existing routines into the plan.
+- Put hard tasks at the peak focus hour.
+- Every start_time must be after Now; "immediate" tasks start at Next minute."""
+
+CONVO_RULES = """Reply in 1-2 sentences as a steady anchor.
+If the user says yes/okay to your last message, confirm and switch to task mode.
+If they seem overwhelmed, suggest a 2-minute breathing break."""
+
+SUMMARY_RULES = """Update the running summary of this chat for your own memory.
+Keep what the user shared (tasks, deadlines, feelings, names), decisions made and open threads; drop small talk.
+Return only the summary, plain text, at most 80 words."""
+
+INTENT_RULES = """Classify the user's message. Return ONLY JSON:
+{"intent": str, "action": task to do or null, "temporal_reference": "after_previous"|"none", "time_of_the_task": "HH:MM"|"YYYY-MM-DD HH:MM"|null, "is_routine": bool}
+Intents (pick one):
+- task_decomposition: ONE concrete task to do now, or "start"/"do"/"lets go" ("Help me study calculus")
+- day_planning: several tasks, or today/my day/schedule/plan, even without times ("Plan my day")
+- routine_management: explicitly recurring, not for now ("Every night I journal")
+- profile_update: traits, energy, focus or support needs ("I'm a morning person", "I prefer short steps")
+- conversation: chat, feelings, vague help ("I'm tired", "can you help me?")
+Never pick conversation if a task can be identified; otherwise, if unsure, pick conversation.
+Only infer habits from explicit repetition. Resolve "tomorrow" etc. to real dates from Now."""
+
+
+def profile_descriptor(pfp):
+    """{"time_blindness": True, "chronotype": "morning"} -> 'time-blind, chronotype: morning'"""
+    parts = []
+    for key, value in (pfp or {}).items():
+        if value is True:
+            parts.append(_TRAITS.get(key, key.replace("_", " ")))
+        elif value not in (False, None, "", [], {}):
+            parts.append(f"{key.replace('_', ' ')}: {value}")
+    return ", ".join(parts)
+
+
+def base_prompt(pfp):
+    descriptor = profile_descriptor(pfp)
+    return f"{PERSONA}\nUser profile: {descriptor}." if descriptor else PERSONA
+
+
+def estimate_tokens(text):
+    # ~4 characters per token for English; good enough to track trends per call type
+    return (len(text) + 3) // 4
+
+
+# per-call-type totals are always kept for /health; PROMPT_LOG=1 also prints every call
+PROMPT_LOG = os.getenv("PROMPT_LOG", "0").lower() in ("1", "true", "yes")
+token_stats = {}
+
+def build(call_type, base, rules, user):
+    system = f"{base}\n\n{rules}" if base else rules
+    tokens = estimate_tokens(system) + estimate_tokens(user)
+    stats = token_stats.setdefault(call_type, {"calls": 0, "tokens": 0})
+    stats["calls"] += 1
+    stats["tokens"] += tokens
+    if PROMPT_LOG:
+        print(f"🧮 {call_type} prompt ~{tokens} tokens")
+    return system, user
+
+
+def prompt_token_stats():
+    return {name: dict(s, avg=round(s["tokens"] / s["calls"], 1)) for name, s in token_stats.items()}
+
+
+def decompose(base, task):
+    return build("decompose", base, DECOMPOSE_RULES, f"Task: {task}")
+
+
+def plan(base, request, el, now_str, next_minute_str, peak_hr, routines):
+    user = (f"Now: {now_str}\nNext minute: {next_minute_str}\nPeak focus hour: {peak_hr}\n"
+            f"Existing routines: {json.dumps(routines, separators=(',', ':'))}\n"
+            f"Energy: {el}\nRequest: {request}")
+    return build("plan", base, PLAN_RULES, user)
+
+
+def convo(base, user_input, history, last_message, summary=""):
+    history_text = "\n".join(history) or "(none)"
+    earlier = f"Earlier in this chat: {summary}\n" if summary else ""
+    user = f"{earlier}Recent chat:\n{history_text}\nYour last message: {last_message}\nUser: {user_input}"
+    return build("convo", base, CONVO_RULES, user)
+
+
+def summary(previous, lines):
+    user = f"Summary so far: {previous or '(none)'}\nNew lines:\n" + "\n".join(lines)
+    return build("summary", "", SUMMARY_RULES, user)
+
+
+def intent(user_text, now_str):
+    return build("intent", "", INTENT_RULES, f"Now: {now_str}\nInput: {user_text}")
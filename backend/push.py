@@ -0,0 +1,99 @@
+import json
+import time
+import asyncio
+from datetime import datetime
+from db import next_due_at
+from LLMs import get_ist_time
+
+# Server-push replacement for /heartbeat polling: each open stream sleeps until the
+# next idle-nudge deadline or task_queue due time instead of asking every 45 seconds.
+IDLE_NUDGE_SECONDS = 300
+KEEPALIVE_SECONDS = 25
+PUSH_TYPES = ("nudge", "commitment_check")
+
+_wakeups = {}
+
+
+def poke(session_id):
+    """Wake a session's stream so it re-reads its timers after the state changed."""
+    wake = _wakeups.get(session_id)
+    if wake is not None:
+        wake.set()
+
+
+def idle_nudge(state):
+    if state.get('active_steps') and state.get('last_action_timestamp'):
+        if time.time() - state['last_action_timestamp'] > IDLE_NUDGE_SECONDS:
+            return {
+                "type": "nudge",
+                "text": "Still working on that step, or are we stuck?",
+                "options": ["Still on it", "Help!", "Skip"]
+            }
+    return None
+
+
+def _seconds_until(timestamp):
+    try:
+        due = datetime.strptime(timestamp, "%Y-%m-%d %H:%M")
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (due - get_ist_time()).total_seconds())
+
+
+def _idle_deadline(state):
+    last = state.get('last_action_timestamp')
+    if not state.get('active_steps') or not last or state.get('idle_nudged_at') == last:
+        return None
+    return max(0.0, last + IDLE_NUDGE_SECONDS - time.time())
+
+
+def _sse(message):
+    return f"data: {json.dumps(message)}\n\n"
+
+
+async def session_stream(session_id, sessions, run_turn):
+    """
+    Yields SSE frames for one session. run_turn(state) runs a scheduler pass
+    (what a HEARTBEAT used to do) and is only called once a task is due.
+    """
+    wake = _wakeups.setdefault(session_id, asyncio.Event())
+    fired_due = None
+    try:
+        while True:
+            state = sessions.get(session_id)
+            timers = [KEEPALIVE_SECONDS]
+            due = next_due_at(session_id) if state is not None else None
+            if state is not None:
+                idle_in = _idle_deadline(state)
+                if idle_in is not None:
+                    timers.append(idle_in + 0.5)
+                due_in = _seconds_until(due) if due != fired_due else None
+                if due_in is not None:
+                    timers.append(due_in)
+
+            wake.clear()
+            try:
+                await asyncio.wait_for(wake.wait(), min(timers))
+                continue
+            except asyncio.TimeoutError:
+                pass
+
+            state = sessions.get(session_id)
+            message = None
+            if state is not None:
+                message = idle_nudge(state)
+                if message and state.get('idle_nudged_at') != state['last_action_timestamp']:
+                    state['idle_nudged_at'] = state['last_action_timestamp']
+                    sessions.commit(session_id)
+                else:
+                    message = None
+                if message is None and due and due != fired_due and _seconds_until(due) == 0:
+                    fired_due = due
+                    response = await run_turn(state)
+                    if isinstance(response, dict) and response.get("type") in PUSH_TYPES:
+                        message = response
+
+            yield _sse(message) if message else ": keepalive\n\n"
+    finally:
+        if _wakeups.get(session_id) is wake:
+            del _wakeups[session_id]
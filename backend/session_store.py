@@ -0,0 +1,310 @@
+import os
+import time
+import asyncio
+from collections import OrderedDict
+from db import save_sessions, get_session, get_session_version, delete_session, get_cipher
+from initstate import dump_state, load_state, init_state
+from jobs import HeldEffects
+
+SESSION_MAX = int(os.getenv("SESSION_MAX", "10000"))
+SESSION_IDLE_TTL = float(os.getenv("SESSION_IDLE_TTL", "3600"))
+SESSION_FLUSH_SECONDS = float(os.getenv("SESSION_FLUSH_SECONDS", "5"))
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "sqlite")  # memory | sqlite | redis
+SESSION_SHARED = os.getenv("SESSION_SHARED")  # force shared (multi-worker) mode on/off
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+SESSION_COMMIT_RETRIES = int(os.getenv("SESSION_COMMIT_RETRIES", "3"))
+
+
+def _snapshot(state):
+    return dump_state(state)
+
+
+class SessionConflict(Exception):
+    """Another worker committed a newer version of this session first."""
+
+
+# Backends all speak the same small protocol: load / version / save_many / delete.
+# save_many takes {session_id: (state snapshot bytes, expected version)} and returns the ids that
+# lost the compare-and-swap.
+
+class MemoryBackend:
+    """Process-local; nothing survives a restart. Handy for tests and single-worker dev."""
+    shared = False
+
+    def __init__(self):
+        self.rows = {}
+
+    def load(self, session_id):
+        row = self.rows.get(session_id)
+        return (load_state(row[1]), row[0]) if row else None
+
+    def version(self, session_id):
+        row = self.rows.get(session_id)
+        return row[0] if row else 0
+
+    def save_many(self, snapshots):
+        conflicts = []
+        for sid, (blob, expected) in snapshots.items():
+            if self.version(sid) != expected:
+                conflicts.append(sid)
+            else:
+                self.rows[sid] = (expected + 1, blob)
+        return conflicts
+
+    def delete(self, session_id):
+        self.rows.pop(session_id, None)
+
+
+class SQLiteBackend:
+    """The encrypted `sessions` table; shared between workers on one host."""
+    shared = False
+
+    def load(self, session_id):
+        row = get_session(session_id)
+        return (load_state(row[0]), row[1]) if row else None
+
+    def version(self, session_id):
+        return get_session_version(session_id)
+
+    def save_many(self, snapshots):
+        return save_sessions(snapshots)
+
+    def delete(self, session_id):
+        delete_session(session_id)
+
+
+class RedisBackend:
+    """Any Redis-protocol server (or fakeredis); sessions are hashes of {version, blob}."""
+    shared = True
+
+    def __init__(self, client=None, url=REDIS_URL, prefix="session:", ttl=7 * 24 * 3600):
+        import redis
+        self.WatchError = redis.WatchError
+        self.client = client if client is not None else redis.Redis.from_url(url)
+        self.prefix = prefix
+        self.ttl = ttl
+
+    def load(self, session_id):
+        version, blob = self.client.hmget(self.prefix + session_id, "version", "blob")
+        if blob is None:
+            return None
+        return load_state(get_cipher().decrypt(blob)), int(version)
+
+    def version(self, session_id):
+        return int(self.client.hget(self.prefix + session_id, "version") or 0)
+
+    def save_many(self, snapshots):
+        conflicts = []
+        for sid, (blob, expected) in snapshots.items():
+            key = self.prefix + sid
+            with self.client.pipeline() as pipe:
+                try:
+                    pipe.watch(key)
+                    if int(pipe.hget(key, "version") or 0) != expected:
+                        conflicts.append(sid)
+                        continue
+                    pipe.multi()
+                    pipe.hset(key, mapping={"version": expected + 1, "blob": get_cipher().encrypt(blob)})
+                    pipe.expire(key, self.ttl)
+                    pipe.execute()
+                except self.WatchError:
+                    conflicts.append(sid)
+        return conflicts
+
+    def delete(self, session_id):
+        self.client.delete(self.prefix + session_id)
+
+
+def make_backend(name=SESSION_BACKEND):
+    return {"memory": MemoryBackend, "sqlite": SQLiteBackend, "redis": RedisBackend}[name]()
+
+
+class SessionStore:
+    """
+    Bounded in-memory session cache in front of a session backend. Behaves like the
+    old module-level dict; states handed out by store[sid] (handlers) or committed are
+    assumed dirty and are written back by flush() (write-behind) or when they are evicted.
+    get() and `in` are read-only peeks: they neither dirty the session nor keep it alive.
+
+    In shared mode (several workers/replicas on one backend) every get() revalidates
+    the cached copy's version and callers commit() at the end of a turn; a False
+    return means another worker got there first and the turn should be replayed.
+    """
+
+    def __init__(self, backend=None, max_size=SESSION_MAX, idle_ttl=SESSION_IDLE_TTL, shared=None):
+        self.backend = backend if backend is not None else make_backend()
+        if shared is None:
+            shared = SESSION_SHARED.lower() in ("1", "true", "yes") if SESSION_SHARED else self.backend.shared
+        self.shared = shared
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self.live = OrderedDict()
+        self.versions = {}
+        self.last_seen = {}
+        self.dirty = set()
+        self.sizes = {}  # snapshot size at the last write, so stats() needn't serialize
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.restored = 0
+        self.evictions = 0
+        self.conflicts = 0
+
+    def get(self, session_id, default=None):
+        state = self.live.get(session_id)
+        if state is not None and self.shared and self.backend.version(session_id) != self.versions[session_id]:
+            self._forget(session_id)
+            state = None
+        if state is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            loaded = self.backend.load(session_id)
+            if loaded is None:
+                return default
+            state, version = loaded
+            self.restored += 1
+            self._admit(session_id, state, version)
+        return state
+
+    def _touch(self, session_id):
+        self.live.move_to_end(session_id)
+        self.last_seen[session_id] = time.monotonic()
+        self.dirty.add(session_id)
+
+    def _admit(self, session_id, state, version):
+        self.live[session_id] = state
+        self.versions[session_id] = version
+        self.last_seen[session_id] = time.monotonic()
+        while len(self.live) > self.max_size:
+            self._evict(next(iter(self.live)))
+
+    def _forget(self, session_id):
+        self.live.pop(session_id, None)
+        self.versions.pop(session_id, None)
+        self.last_seen.pop(session_id, None)
+        self.dirty.discard(session_id)
+        self.total_bytes -= self.sizes.pop(session_id, 0)
+
+    def _evict(self, session_id):
+        if session_id in self.dirty:
+            self._write(self._collect([session_id]))
+        self._forget(session_id)
+        self.evictions += 1
+
+    def __getitem__(self, session_id):
+        state = self.get(session_id)
+        if state is None:
+            raise KeyError(session_id)
+        self._touch(session_id)
+        return state
+
+    def __setitem__(self, session_id, state):
+        version = self.versions.get(session_id)
+        if version is None:
+            version = self.backend.version(session_id)
+        self._admit(session_id, state, version)
+        self._touch(session_id)
+
+    def __delitem__(self, session_id):
+        self._forget(session_id)
+        self.backend.delete(session_id)
+
+    def __contains__(self, session_id):
+        return self.get(session_id) is not None
+
+    def __len__(self):
+        return len(self.live)
+
+    def _collect(self, session_ids):
+        # serialize on the caller's thread so the actual write can happen elsewhere
+        snapshots = {sid: (_snapshot(self.live[sid]), self.versions[sid]) for sid in session_ids if sid in self.live}
+        self.dirty.difference_update(session_ids)
+        for sid, (blob, _) in snapshots.items():
+            self.total_bytes += len(blob) - self.sizes.get(sid, 0)
+            self.sizes[sid] = len(blob)
+        return snapshots
+
+    def _settle(self, snapshots, conflicts):
+        for sid, (_, expected) in snapshots.items():
+            if sid in conflicts:
+                self.conflicts += 1
+                self._forget(sid)
+            elif self.versions.get(sid) == expected:
+                self.versions[sid] = expected + 1
+        return not conflicts
+
+    def _write(self, snapshots):
+        return self._settle(snapshots, self.backend.save_many(snapshots)) if snapshots else True
+
+    def commit(self, session_id):
+        """End of a turn. Shared mode writes through now; returns False if the turn lost a race."""
+        if not self.shared:
+            if session_id in self.live:
+                self.dirty.add(session_id)
+            return True
+        return self._write(self._collect([session_id]))
+
+    async def run_turn(self, session_id, turn, fresh=init_state, retries=SESSION_COMMIT_RETRIES):
+        """
+        Runs `await turn(state)` on the session and commits it. If another worker committed the
+        session first, the turn is replayed on the fresh copy (LLM answers come back from the
+        cache); XP, activity rows and task writes are held until a commit wins, so a replay can't
+        repeat them. fresh(session_id) builds missing sessions (None: return None instead).
+        Raises SessionConflict once `retries` attempts have all lost.
+        """
+        for attempt in range(retries):
+            if session_id not in self:
+                if fresh is None:
+                    return None
+                self[session_id] = fresh(session_id)
+            state = self[session_id]
+            with HeldEffects() as effects:
+                result = await turn(state)
+            if self.commit(session_id):
+                effects.release()
+                return result
+            effects.discard()
+            print(f"🔁 Session {session_id} changed under us, replaying turn")
+        raise SessionConflict(session_id)
+
+    def collect_dirty(self):
+        return self._collect(list(self.dirty))
+
+    def expire_idle(self):
+        cutoff = time.monotonic() - self.idle_ttl
+        for session_id in [sid for sid, seen in self.last_seen.items() if seen < cutoff]:
+            self._evict(session_id)
+
+    def flush(self):
+        self._write(self.collect_dirty())
+
+    async def run_flusher(self, interval=SESSION_FLUSH_SECONDS):
+        while True:
+            await asyncio.sleep(interval)
+            snapshots = self.collect_dirty()
+            try:
+                if snapshots:
+                    conflicts = await asyncio.to_thread(self.backend.save_many, snapshots)
+                    if not self._settle(snapshots, conflicts):
+                        print(f"⚠️ Session write-behind lost {len(conflicts)} race(s); reloading from backend")
+                self.expire_idle()
+            except Exception as e:
+                self.dirty.update(sid for sid in snapshots if sid in self.live)
+                print(f"❌ Session flush failed: {e}")
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__,
+            "shared": self.shared,
+            "live": len(self.live),
+            "dirty": len(self.dirty),
+            "hits": self.hits,
+            "misses": self.misses,
+            "restored": self.restored,
+            "evictions": self.evictions,
+            "conflicts": self.conflicts,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "approx_bytes": self.total_bytes,
+        }
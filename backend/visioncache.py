@@ -0,0 +1,142 @@
+import io
+import os
+import time
+import threading
+from collections import OrderedDict
+from PIL import Image
+
+# Re-photographing the same desk or bill shouldn't cost another Gemini call: uploads are
+# reduced to a 64-bit difference hash and a session reuses the claim of any recent upload
+# within VISION_CACHE_DISTANCE differing bits.
+VISION_CACHE_DISTANCE = int(os.getenv("VISION_CACHE_DISTANCE", "6"))
+VISION_CACHE_TTL = float(os.getenv("VISION_CACHE_TTL", str(24 * 3600)))
+VISION_CACHE_PER_SESSION = int(os.getenv("VISION_CACHE_PER_SESSION", "32"))
+VISION_CACHE_SESSIONS = int(os.getenv("VISION_CACHE_SESSIONS", "10000"))
+
+
+def dhash(image_bytes, size=8):
+    """64-bit dHash: is each pixel brighter than its right neighbour on a 9x8 grayscale thumbnail."""
+    img = Image.open(io.BytesIO(image_bytes))
+    img.draft("L", (size * 8, size * 8))
+    pixels = list(img.convert("L").resize((size + 1, size), Image.Resampling.BILINEAR).getdata())
+    bits = 0
+    for row in range(size):
+        offset = row * (size + 1)
+        for col in range(size):
+            bits = (bits << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return bits
+
+
+class ClaimCache:
+    def __init__(self, distance=VISION_CACHE_DISTANCE, ttl=VISION_CACHE_TTL,
+                 per_session=VISION_CACHE_PER_SESSION, max_sessions=VISION_CACHE_SESSIONS):
+        self.distance = distance
+        self.ttl = ttl
+        self.per_session = per_session
+        self.max_sessions = max_sessions
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+
+    def lookup(self, session_id, image_hash):
+        """Claim of the closest live entry within `distance` bits, else None."""
+        now = time.monotonic()
+        with self.lock:
+            entries = self.sessions.get(session_id)
+            best = None
+            if entries:
+                for key, (expires, claim) in list(entries.items()):
+                    if expires < now:
+                        del entries[key]
+                        self.expired += 1
+                        continue
+                    gap = (key ^ image_hash).bit_count()
+                    if gap <= self.distance and (best is None or gap < best[0]):
+                        best = (gap, key, claim)
+            if best is None:
+                self.misses += 1
+                return None
+            entries.move_to_end(best[1])
+            self.sessions.move_to_end(session_id)
+            self.hits += 1
+            return best[2]
+
+    def store(self, session_id, image_hash, claim):
+        with self.lock:
+            entries = self.sessions.setdefault(session_id, OrderedDict())
+            entries[image_hash] = (time.monotonic() + self.ttl, claim)
+            entries.move_to_end(image_hash)
+            self.sessions.move_to_end(session_id)
+            while len(entries) > self.per_session:
+                entries.popitem(last=False)
+                self.evictions += 1
+            while len(self.sessions) > self.max_sessions:
+                _, dropped = self.sessions.popitem(last=False)
+                self.evictions += len(dropped)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "expired": self.expired,
+            "evictions": self.evictions,
+            "sessions": len(self.sessions),
+            "distance": self.distance,
+        }
+
+
+def test_claim_cache():
+    print("📸 SAME DESK, DIFFERENT PHOTOS 📸")
+    import random
+
+    def photo(seed, touched=()):
+        # a 9x8 grid of gray cells blown up to 90x80; touching a cell flips a few hash bits
+        rng = random.Random(seed)
+        cells = [rng.randrange(256) for _ in range(72)]
+        for i in touched:
+            cells[i] = 255 - cells[i]
+        img = Image.new("L", (9, 8))
+        img.putdata(cells)
+        buf = io.BytesIO()
+        img.resize((90, 80), Image.Resampling.NEAREST).save(buf, "PNG")
+        return buf.getvalue()
+
+    calls = []
+
+    def stub_model(image_bytes):
+        calls.append(image_bytes)
+        return f"claim #{len(calls)}"
+
+    def claim(cache, session_id, image_bytes):
+        # the /vision/{session_id} flow: hash, reuse a close enough claim, else ask the model
+        image_hash = dhash(image_bytes)
+        found = cache.lookup(session_id, image_hash)
+        if found is None:
+            found = stub_model(image_bytes)
+            cache.store(session_id, image_hash, found)
+        return found
+
+    desk, retake, other = photo(1), photo(1, touched=(20,)), photo(2)
+    gap_retake = (dhash(desk) ^ dhash(retake)).bit_count()
+    gap_other = (dhash(desk) ^ dhash(other)).bit_count()
+    cache = ClaimCache(distance=6, ttl=0.2)
+    checks = [("retake is within the threshold", 0 < gap_retake <= cache.distance),
+              ("other photo is over the threshold", gap_other > cache.distance)]
+
+    first = claim(cache, "a", desk)
+    checks.append(("near-duplicate is a hit", claim(cache, "a", retake) == first and len(calls) == 1))
+    checks.append(("distant photo is a miss", claim(cache, "a", other) != first and len(calls) == 2))
+    checks.append(("other session doesn't see it", claim(cache, "b", desk) != first and len(calls) == 3))
+    time.sleep(0.25)
+    checks.append(("expired entry is a miss", claim(cache, "a", desk) != first and len(calls) == 4))
+    stats = cache.stats()
+    checks.append(("stats add up", stats["hits"] == 1 and stats["misses"] == 4 and stats["expired"] == 2))
+
+    for label, ok in checks:
+        print(f"{'✅' if ok else '❌'} {label}")
+    assert all(ok for _, ok in checks)
@@ -53,12 +53,21 @@ export default function SmartCompanionUI() {
     window.speechSynthesis.speak(utterance);
   };
 
-  // 💓 HEARTBEAT
+  // 💓 HEARTBEAT: the server pushes nudges over SSE; only poll if the browser can't stream
   useEffect(() => {
-    const heartbeat = setInterval(() => { 
-        sendEvent("USER_INPUT", "HEARTBEAT"); 
-    }, 45000);
-    return () => clearInterval(heartbeat);
+    if (!window.EventSource) {
+      const heartbeat = setInterval(() => {
+          sendEvent("USER_INPUT", "HEARTBEAT");
+      }, 45000);
+      return () => clearInterval(heartbeat);
+    }
+    const stream = new EventSource(`${API_BASE}/stream/${sessionId}`);
+    stream.onmessage = (e) => {
+      setIsPulsing(true);
+      setTimeout(() => setIsPulsing(false), 1500);
+      handleBackendDecision(JSON.parse(e.data));
+    };
+    return () => stream.close();
   }, []);
 
   useEffect(() => {